@@ -0,0 +1,210 @@
+import os
+
+from collections import Counter
+from datetime import date
+from datetime import timedelta
+from functools import partial
+import semantics
+import gmail_tools
+import utils
+from message_parsing import ParsePool, chunk_email, CHUNK_STRIDE
+from pipeline import Pipeline, Stage
+
+
+WINDOW_DAYS = 5
+# Windows listing more messages than one page are split in half
+WINDOW_LIMIT = 500
+LIST_WORKERS = 4
+# Processes decoding and cleaning message bodies, set with 'parse_workers' in config.json
+PARSE_WORKERS = utils.get_json_field('config.json', 'parse_workers') or os.cpu_count()
+
+
+class WindowEnd:
+    """Follows the last id batch of a window through the pipeline, carrying how
+    many batches and message ids the window was listed as."""
+
+    def __init__(self, batches: int, ids: int):
+        self.batches = batches
+        self.ids = ids
+
+
+def make_windows(first_day: date, last_day: date) -> list[tuple[date, date]]:
+    # Half open [start, end) windows, as used by Gmail's after:/before:
+    windows = []
+    curr_time = first_day
+    while curr_time < last_day:
+        windows.append((curr_time, curr_time + timedelta(days=WINDOW_DAYS)))
+        curr_time += timedelta(days=WINDOW_DAYS)
+    return windows
+
+
+def list_window(window: tuple[date, date]):
+    start, end = window
+    if gmail_tools.mail_store.covers(start, end - timedelta(days=1)):
+        # Finished by an earlier run
+        return
+
+    service = gmail_tools.thread_gmail()
+    query = gmail_tools.build_gmail_query(start=start, end=end)
+    ids = list(gmail_tools.iter_message_ids(query, WINDOW_LIMIT + 1, service))
+
+    if len(ids) > WINDOW_LIMIT:
+        if end - start > timedelta(days=1):
+            mid = start + timedelta(days=(end - start).days // 2)
+            yield from list_window((start, mid))
+            yield from list_window((mid, end))
+            return
+        # A single day can't be split any further
+        ids = list(gmail_tools.iter_message_ids(query, service=service))
+
+    # Id batches are sized for one Gmail batch request each
+    batches = 0
+    for i in range(0, len(ids), gmail_tools.FETCH_BATCH_SIZE):
+        yield (window, ids[i:i + gmail_tools.FETCH_BATCH_SIZE])
+        batches += 1
+    yield (window, WindowEnd(batches, len(ids)))
+
+
+def fetch(item):
+    window, ids = item
+    if isinstance(ids, WindowEnd):
+        return [item]
+
+    found = gmail_tools.mail_store.get_emails(ids)
+    missing = [id for id in ids if id not in found]
+    gone = set()
+    raw = gmail_tools.fetch_message_batch(missing, gone) if missing else []
+    return [(window, (list(found.values()), raw, len(gone)))]
+
+
+def clean(pool: ParsePool, item):
+    window, batch = item
+    if isinstance(batch, WindowEnd):
+        return [item]
+
+    cached, raw, gone = batch
+    parsed = [(email, None) for email in cached] + pool.parse(raw)
+    emails = [email for email, _ in parsed]
+
+    # Chunks come back from the parse workers, stored emails are chunked here
+    chunk_info, texts = [], []
+    for email, chunks in parsed:
+        if semantics.is_embedded(email):
+            continue
+        if chunks is None:
+            chunks = chunk_email(email)
+        for i, chunk in enumerate(chunks):
+            chunk_info.append((email.sentOn, email.email_id, i * CHUNK_STRIDE))
+            texts.append(chunk)
+
+    return [(window, (emails, chunk_info, texts, gone))]
+
+
+def embed(item):
+    window, batch = item
+    if isinstance(batch, WindowEnd):
+        return [item]
+
+    emails, chunk_info, texts, gone = batch
+    return [(window, (emails, chunk_info, semantics.embed_texts(texts) if texts else None, gone))]
+
+
+class WindowWriter:
+    """Last backfill stage. Marks a window complete once all of its listed
+    messages are stored, unless it reaches into today."""
+
+    def __init__(self, today: date):
+        self.today = today
+        self.expected = {}
+        self.written = Counter()
+        self.emails = Counter()
+        # Messages stored or deleted from Gmail since they were listed
+        self.accounted = Counter()
+        self.completed = 0
+        self.incomplete = 0
+
+    def __call__(self, item):
+        window, batch = item
+        if isinstance(batch, WindowEnd):
+            self.expected[window] = batch
+        else:
+            emails, chunk_info, vectors, gone = batch
+            gmail_tools.mail_store.add_emails(emails)
+            if vectors is not None:
+                semantics.store_embeddings(chunk_info, vectors)
+            self.written[window] += 1
+            self.emails[window] += len(emails)
+            self.accounted[window] += len(emails) + gone
+
+        # Batches of a window can overtake its end marker on parallel workers
+        if window in self.expected and self.expected[window].batches == self.written[window]:
+            self._complete(window)
+
+    def _complete(self, window: tuple[date, date]):
+        start, end = window
+        listed = self.expected.pop(window).ids
+        self.written.pop(window, None)
+        stored = self.accounted.pop(window, 0)
+
+        if stored < listed:
+            # Left unmarked so the next run fetches the window again
+            print(f'{start} - {end}: {listed - stored} of {listed} messages not stored, window left for the next run')
+            self.incomplete += 1
+            return
+
+        self.completed += 1
+        if end <= self.today:
+            semantics.flush_vectors()
+            gmail_tools.mail_store.mark_indexed(start, end - timedelta(days=1))
+
+
+def generate_index(days: int = 365):
+    """Backfills the last `days` days into the mail store and semantic index,
+    resuming from finished windows."""
+
+    today_time = date.today()
+    first_day = today_time - timedelta(days=days)
+    windows = make_windows(first_day, today_time)
+
+    writer = WindowWriter(today_time)
+
+    # list -> fetch -> clean/chunk -> embed -> write, all running at once with
+    # bounded queues between them so the year is never held in memory
+    try:
+        with ParsePool(gmail_tools.ids_to_names, PARSE_WORKERS) as pool:
+            Pipeline(windows, [
+                Stage('list', list_window, workers=LIST_WORKERS),
+                Stage('fetch', fetch, workers=gmail_tools.FETCH_WORKERS),
+                # One clean thread per parse process keeps every process busy
+                Stage('clean', partial(clean, pool), workers=PARSE_WORKERS),
+                Stage('embed', embed, workers=2),
+                Stage('write', writer)
+            ]).run()
+    finally:
+        semantics.save_index()
+        print(f'Embedding cache: {semantics.embedding_cache.stats()}')
+        print(f'Backfilled {sum(writer.emails.values())} emails, {writer.completed} windows completed, {writer.incomplete} incomplete')
+
+
+def verify_index(days: int = 365) -> list[dict]:
+    """Checks completed windows against Gmail and clears the watermark of any
+    with missing messages."""
+
+    today_time = date.today()
+    report = []
+
+    for start, end in make_windows(today_time - timedelta(days=days), today_time):
+        if not gmail_tools.mail_store.covers(start, end - timedelta(days=1)):
+            continue
+
+        ids = list(gmail_tools.iter_message_ids(gmail_tools.build_gmail_query(start=start, end=end)))
+        found = gmail_tools.mail_store.get_emails(ids)
+        missing = [id for id in ids if id not in found]
+        if missing:
+            gmail_tools.mail_store.clear_indexed(start, end - timedelta(days=1))
+
+        report.append({"start": start, "end": end, "gmail": len(ids), "stored": len(found), "missing": len(missing)})
+        print(f'{start} - {end}: gmail={len(ids):<6} stored={len(found):<6} missing={len(missing)}')
+
+    return report
+
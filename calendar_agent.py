@@ -21,10 +21,12 @@ from langgraph.checkpoint.memory import InMemorySaver
 from data_schemas import CreateEvent, CreateTask, Email
 import calendar_tools
 import utils
+import services
 
 os.environ["GOOGLE_API_KEY"] = utils.get_json_field('config.json', 'gemini_key')
 
-SYSTEM_PROMPT = f"""You are a helpful AI agent responsible for managing a user's Google Calendar.
+# Filled in with the current date when a request comes in
+SYSTEM_PROMPT = """You are a helpful AI agent responsible for managing a user's Google Calendar.
 An AI chatbot is talking to the user and will relay requests to you in order to help the user. Your goal is to fulfill chatbot's requests using ONLY the tools provided to you. 
 You should think step by step and decide when to use tools to take action. Ensure you reason in every response.
 Respond in this format:
@@ -33,7 +35,7 @@ Thought: [Your reasoning]
 Action: [The structured tool call JSON objects]
 
 INFO:
-Today's date is {calendar_tools.today}
+Today's date is {today}
 
 RULES:
 - If a request is vague ask for more information.
@@ -202,12 +204,13 @@ workflow.add_edge("create_event", "agent")
 
 memory = InMemorySaver()
 
-app = workflow.compile(checkpointer=memory)
+services.register('calendar_agent', lambda: workflow.compile(checkpointer=memory))
 
 
 config = {"configurable": {"thread_id": "1"}}
 
 def start_workflow(request: str = None, answer: str = None):
+    app = services.get('calendar_agent')
 
     if answer:
         events = list(app.stream(
@@ -219,7 +222,7 @@ def start_workflow(request: str = None, answer: str = None):
         events = list(app.stream(
             {
                 "messages": [
-                    SystemMessage(content=SYSTEM_PROMPT),
+                    SystemMessage(content=SYSTEM_PROMPT.format(today=calendar_tools.today)),
                     HumanMessage(content=request)
                 ]
             },
@@ -12,33 +12,38 @@ from pydantic import BaseModel
 import pytz
 import iso8601
 import utils
+import services
 
-from googleapiclient.discovery import build, Resource
+from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError
 from data_schemas import CreateTask, CreateEvent
 
-g_cal = None
-g_tasks = None
-default_tasklist = None
-time_zone = None
-today = None
+def _open_tasks() -> Resource:
+    return services.discovery_client('tasks', 'v1', utils.creds)
 
-def init_tasks(creds):
-    global g_tasks, default_tasklist
-    g_tasks = build('tasks', 'v1', credentials=creds)
-    tasklists = g_tasks.tasklists().list().execute().get('items', [])
-    if tasklists: default_tasklist = tasklists[0]['id']
+def _open_calendar() -> Resource:
+    return services.discovery_client('calendar', 'v3', utils.creds)
 
-def init_calendar(creds):
-    global g_cal, time_zone, today
-    g_cal = build('calendar', 'v3', credentials=creds)
-    tz = g_cal.calendarList().get(calendarId='primary').execute()
-    time_zone = pytz.timezone(tz['timeZone'])
-    today = datetime.now(time_zone)
+def _default_tasklist() -> str:
+    tasklists = services.get('tasks').tasklists().list().execute().get('items', [])
+    return tasklists[0]['id'] if tasklists else None
+
+def _time_zone():
+    tz = services.get('calendar').calendarList().get(calendarId='primary').execute()
+    return pytz.timezone(tz['timeZone'])
+
+def __getattr__(name: str):
+    # time_zone, today and default_tasklist are looked up on first read, not at import
+    if name == 'today':
+        return datetime.now(services.get('time_zone'))
+    if name in ('time_zone', 'default_tasklist'):
+        return services.get(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def add_task(t: CreateTask) -> str:
-    global g_tasks
+    g_tasks = services.get('tasks')
+    default_tasklist = services.get('default_tasklist')
 
     try:
         task_result = g_tasks.tasks().insert(
@@ -56,7 +61,9 @@ def add_task(t: CreateTask) -> str:
     }, indent=2)
 
 def reschedule_task(task_id: str, due: datetime) -> str:
-    global g_tasks
+    g_tasks = services.get('tasks')
+    default_tasklist = services.get('default_tasklist')
+    time_zone = services.get('time_zone')
 
     try:
         task_result = g_tasks.tasks().patch(
@@ -77,7 +84,8 @@ def reschedule_task(task_id: str, due: datetime) -> str:
     }, indent=2)
 
 def remove_task(task_id: str) -> str:
-    global g_tasks
+    g_tasks = services.get('tasks')
+    default_tasklist = services.get('default_tasklist')
     
     try:
         g_tasks.tasks().delete(
@@ -91,7 +99,7 @@ def remove_task(task_id: str) -> str:
 
 
 def add_event(e: CreateEvent) -> str:
-    global g_cal
+    g_cal = services.get('calendar')
 
     try:
         event_result = g_cal.events().insert(
@@ -114,7 +122,8 @@ def add_event(e: CreateEvent) -> str:
     }, indent=2)
 
 def reschedule_event(event_id: str, start: datetime, end: datetime) -> str:
-    global g_cal
+    g_cal = services.get('calendar')
+    time_zone = services.get('time_zone')
 
     try:
         g_cal.events().patch(
@@ -142,7 +151,7 @@ def reschedule_event(event_id: str, start: datetime, end: datetime) -> str:
 
 
 def remove_event(event_id: str):
-    global g_cal
+    g_cal = services.get('calendar')
     
     try:
         g_cal.events().delete(
@@ -160,7 +169,8 @@ def is_naive(dt: datetime):
     return dt.tzinfo is None or dt.tzinfo.utcoffset(dt) is None
 
 def get_events_in_range(start: datetime, end: datetime) -> list:
-    global g_cal
+    g_cal = services.get('calendar')
+    time_zone = services.get('time_zone')
 
     try:
         events_result = g_cal.events().list(
@@ -199,7 +209,8 @@ def get_events_in_range(start: datetime, end: datetime) -> list:
 
 
 def get_tasks_in_range(start: datetime, end: datetime) -> list:
-    global g_tasks
+    g_tasks = services.get('tasks')
+    time_zone = services.get('time_zone')
 
     try:
         results = g_tasks.tasklists().list(maxResults=10).execute()
@@ -232,6 +243,8 @@ def get_tasks_in_range(start: datetime, end: datetime) -> list:
     return tasks_in_range
 
 
-init_calendar(utils.creds)
-init_tasks(utils.creds)
+services.register('calendar', _open_calendar)
+services.register('tasks', _open_tasks)
+services.register('time_zone', _time_zone)
+services.register('default_tasklist', _default_tasklist)
 
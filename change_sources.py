@@ -0,0 +1,134 @@
+import base64
+import json
+import threading
+import time
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from googleapiclient.discovery import Resource
+from requests.exceptions import Timeout
+
+
+PUBSUB_URL = 'https://pubsub.googleapis.com/v1'
+
+
+class ChangeSource:
+    """Calls `notify` with the mailbox's new history id, or None when unknown."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._notify = None
+
+    def start(self, notify):
+        self._notify = notify
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class PollingSource(ChangeSource):
+    """Polls getProfile, backing off from `min_interval` to `max_interval`
+    while the history id stays put."""
+
+    def __init__(self, gmail: Resource, min_interval: float = 2., max_interval: float = 300., backoff: float = 1.5):
+        super().__init__()
+        self.gmail = gmail
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def _run(self):
+        latest = None
+        while not self._stop.wait(self.interval):
+            try:
+                history_id = self.gmail.users().getProfile(userId='me').execute()['historyId']
+            except Exception as error:
+                # Transport and auth refresh errors too, the thread must outlive them
+                print(f'Polling for new mail failed: {error}')
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+                continue
+
+            if history_id != latest:
+                self._notify(history_id)
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            latest = history_id
+
+
+class PushSource(ChangeSource):
+    """Gmail push notifications pulled from a Pub/Sub subscription, with a
+    history check every `backstop` seconds in case one is dropped."""
+
+    def __init__(self, gmail: Resource, topic: str, subscription: str,
+                 backstop: float = 900., renew_every: float = 86400.):
+        super().__init__()
+        self.gmail = gmail
+        self.topic = topic
+        self.subscription = subscription
+        self.backstop = backstop
+        self.renew_every = renew_every
+        self._session = None
+
+    def _run(self):
+        credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+        self._session = AuthorizedSession(credentials)
+        watched_at = 0.
+        last_notice = time.monotonic()
+        retry = 1.
+
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - watched_at > self.renew_every:
+                    self.gmail.users().watch(userId='me', body={'topicName': self.topic}).execute()
+                    watched_at = time.monotonic()
+
+                history_ids = self._pull()
+                retry = 1.
+            except Exception as error:
+                print(f'Gmail push notifications failed: {error}')
+                self._stop.wait(retry)
+                retry = min(retry * 2, 300.)
+                continue
+
+            if history_ids:
+                self._notify(max(history_ids, key=int))
+                last_notice = time.monotonic()
+            elif time.monotonic() - last_notice > self.backstop:
+                self._notify(None)
+                last_notice = time.monotonic()
+
+    def _pull(self) -> list[str]:
+        try:
+            response = self._session.post(
+                f'{PUBSUB_URL}/{self.subscription}:pull', json={"maxMessages": 100}, timeout=self.backstop
+            )
+        except Timeout:
+            return []
+        response.raise_for_status()
+
+        received = response.json().get('receivedMessages', [])
+        if not received:
+            return []
+
+        self._session.post(
+            f'{PUBSUB_URL}/{self.subscription}:acknowledge', json={"ackIds": [m['ackId'] for m in received]}
+        ).raise_for_status()
+
+        return [str(json.loads(base64.b64decode(m['message']['data']))['historyId']) for m in received]
+
+
+class FakeSource(ChangeSource):
+    """In-process source for tests, changes are announced with `push`."""
+
+    def start(self, notify):
+        self._notify = notify
+
+    def push(self, history_id: str = None):
+        if not self._stop.is_set():
+            self._notify(history_id)
@@ -19,6 +19,7 @@ import calendar_tools
 import calendar_agent
 import gmail_agent
 import utils
+import services
 from enum import Enum
 end = False
 
@@ -222,14 +223,14 @@ workflow.add_conditional_edges(
 workflow.add_edge("call_calendar_agent", "chatbot")
 workflow.add_edge("call_gmail_agent", "chatbot")
 
-app = workflow.compile()
+services.register('chatbot', workflow.compile)
 
 
 config = {"configurable": {"thread_id": "1"}}
 
 
 def start_new_email_agent(email):
-    return app.stream(
+    return services.get('chatbot').stream(
         {
             "messages": [
                 SystemMessage(content=make_email_prompt(email)),
@@ -276,7 +277,7 @@ Rules for Gmail Agent:
 """
 
 def start_new_conversation_agent():
-    return app.stream(
+    return services.get('chatbot').stream(
         {
             "messages": [
                 SystemMessage(content=make_conversation_prompt()),
@@ -1,4 +1,7 @@
+import asyncio
 import json
+import random
+import time
 from pydantic import BaseModel, Field
 from data_schemas import Email
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -10,6 +13,14 @@ import utils
 labelMap = {}
 UserLabelEnum = None
 
+# 'concurrent' sends one email per request, 'packed' several per request
+CLASSIFY_MODE = utils.get_json_field('config.json', 'classify_mode') or 'packed'
+CLASSIFY_CONCURRENCY = 8
+EMAILS_PER_PROMPT = 10
+# Packed prompts only see the start of long emails
+PACKED_EMAIL_CHARS = 4000
+CLASSIFY_RETRIES = 4
+
 
 os.environ["GOOGLE_API_KEY"] = utils.get_json_field('config.json', 'gemini_key')
 
@@ -27,19 +38,87 @@ class UserLabelClassification(BaseModel):
     summary: str = Field(..., description="Short blurb about the contents of the email.")
 
 
-classifier = ChatGoogleGenerativeAI(model='gemini-2.5-flash').with_structured_output(UserLabelClassification)
+class PackedClassification(UserLabelClassification):
+    email_index: int = Field(..., description="Number of the email this classification is for.")
+
+
+class PackedClassifications(BaseModel):
+    classifications: list[PackedClassification] = Field(..., description="One classification for every email.")
+
+
+llm = ChatGoogleGenerativeAI(model='gemini-2.5-flash')
+classifier = llm.with_structured_output(UserLabelClassification)
+packed_classifier = llm.with_structured_output(PackedClassifications)
+
+
+def classify(emails: list[Email], mode: str = CLASSIFY_MODE) -> list[str]:
+    """Label name for each email, or None for emails that still failed after
+    retries. Packed mode falls back to one request per email for any email a
+    packed answer left out."""
+    if not emails:
+        return []
+
+    values = [None] * len(emails)
+    pending = list(range(len(emails)))
+
+    if mode == 'packed':
+        packs = [pending[i:i + EMAILS_PER_PROMPT] for i in range(0, len(pending), EMAILS_PER_PROMPT)]
+        prompts = [make_packed_prompt([emails[i].text for i in pack]) for pack in packs]
+
+        for pack, resp in zip(packs, _invoke_all(packed_classifier, prompts)):
+            for c in resp.classifications if resp else []:
+                if 0 <= c.email_index < len(pack):
+                    values[pack[c.email_index]] = c.classification.value
+        pending = [i for i in pending if values[i] is None]
 
-def classify(emails: list[Email]):
-    values = []
-    
-    for e in emails:
-        resp = classifier.invoke(make_prompt(e.text))
-        gmail_tools.add_email_label(e, resp.classification.value)
-        values.append(resp.classification.value)
+    prompts = [make_prompt(emails[i].text) for i in pending]
+    for i, resp in zip(pending, _invoke_all(classifier, prompts)):
+        if resp:
+            values[i] = resp.classification.value
 
+    if failed := values.count(None):
+        print(f'Classification failed for {failed} of {len(emails)} emails')
     return values
 
+
+def _invoke_all(runnable, prompts: list[str]) -> list:
+    # Runs every prompt through abatch, then retries the ones that raised or came
+    # back unparsed. Quota errors back off exponentially before the next round.
+    results = [None] * len(prompts)
+    pending = list(range(len(prompts)))
+
+    for attempt in range(CLASSIFY_RETRIES):
+        responses = asyncio.run(runnable.abatch(
+            [prompts[i] for i in pending], config={"max_concurrency": CLASSIFY_CONCURRENCY}, return_exceptions=True
+        ))
+
+        throttled = False
+        failed = []
+        for i, resp in zip(pending, responses):
+            if isinstance(resp, Exception) or resp is None:
+                throttled |= _is_quota_error(resp)
+                failed.append(i)
+            else:
+                results[i] = resp
+
+        pending = failed
+        if not pending or attempt == CLASSIFY_RETRIES - 1:
+            break
+        time.sleep((2 ** attempt if throttled else 0) + random.uniform(0, 1))
+
+    return results
+
+
+def _is_quota_error(error) -> bool:
+    return error is not None and any(s in str(error) for s in ('429', 'ResourceExhausted', 'RESOURCE_EXHAUSTED', 'quota'))
+
+
 def make_prompt(email):
     return f"""You are an email inbox assistant. Classify and summarize this email in a structured output:
 {email}"""
 
+
+def make_packed_prompt(emails: list[str]):
+    numbered = "\n\n".join(f"Email {i}:\n{text[:PACKED_EMAIL_CHARS]}" for i, text in enumerate(emails))
+    return f"""You are an email inbox assistant. Classify and summarize each of these {len(emails)} emails in a structured output, giving each classification the number of its email:
+{numbered}"""
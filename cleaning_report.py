@@ -0,0 +1,49 @@
+import email
+import glob
+import os
+import sys
+
+import text_cleaning
+from message_parsing import extract_email_text
+
+
+def load_eml_bodies(corpus_dir: str) -> list[str]:
+    # Same part gmail_tools indexes, the first text/plain one
+    bodies = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.eml'))):
+        with open(path, 'rb') as f:
+            message = email.message_from_binary_file(f)
+        for part in message.walk():
+            if part.get_content_type() == 'text/plain':
+                payload = part.get_payload(decode=True) or b''
+                bodies.append(payload.decode(part.get_content_charset() or 'utf-8', errors='replace'))
+                break
+    return bodies
+
+
+def load_gmail_bodies(n: int = 500) -> list[str]:
+    import gmail_tools
+
+    ids = list(gmail_tools.iter_message_ids('', n))
+    bodies = []
+    for i in range(0, len(ids), gmail_tools.FETCH_BATCH_SIZE):
+        for msg_data in gmail_tools.fetch_message_batch(ids[i:i + gmail_tools.FETCH_BATCH_SIZE]):
+            if body := extract_email_text(msg_data.get('payload', {})):
+                bodies.append(body)
+    return bodies
+
+
+def print_cleaning_report(corpus_dir: str = None, repeat: int = 3):
+    """Benchmarks email text cleaning over a directory of .eml files, or the
+    latest messages in the inbox when no directory is given."""
+    bodies = load_eml_bodies(corpus_dir) if corpus_dir else load_gmail_bodies()
+    report = text_cleaning.benchmark(bodies, repeat)
+
+    print(f'{report["bodies"]} bodies, {report["mb"]:.2f} MB')
+    print(f'{"reference":<12} {report["reference_mb_per_sec"]:8.1f} MB/s')
+    print(f'{"normalizer":<12} {report["normalizer_mb_per_sec"]:8.1f} MB/s')
+    print(f'{"mismatches":<12} {report["mismatches"]:8d}')
+
+
+if __name__ == '__main__':
+    print_cleaning_report(sys.argv[1] if len(sys.argv) > 1 else None)
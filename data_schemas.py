@@ -14,10 +14,13 @@ class Email(BaseModel):
     sender: str = Field(...)
     recipients: list[str] = Field(None, exclude=True)
     sentOn: date = Field(...)
-    subject: str = Field(None)
+    subject: str | None = Field(None)
     email_id: str = Field(...)
     label_names: list[str] = Field(...)
     text: str = Field(None)
+    history_id: str | None = Field(None, exclude=True)
+    # Lowercased names of the headers label rules read, see message_parsing.RULE_HEADERS
+    headers: dict[str, str] = Field(None, exclude=True)
 
 
     def to_dict(self):
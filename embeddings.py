@@ -0,0 +1,178 @@
+import hashlib
+import random
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import AuthorizedSession
+from local_db import batches, connect
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class EmbeddingCache:
+    """Persistent map from (model, normalized chunk text) to its embedding, so
+    boilerplate and re-indexed emails are only ever sent to the endpoint once."""
+
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)')
+        self._conn.commit()
+
+    def key(self, text: str) -> bytes:
+        normalized = re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+        return hashlib.sha256(f'{self.model}\0{normalized}'.encode('utf-8')).digest()
+
+    def get_many(self, texts: list[str]) -> list:
+        keys = [self.key(t) for t in texts]
+        found = {}
+
+        with self._lock:
+            for batch in batches(keys):
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({",".join("?" * len(batch))})', batch
+                ).fetchall()
+                found.update(rows)
+
+            vectors = [np.frombuffer(found[k], dtype='float32') if k in found else None for k in keys]
+            hits = sum(v is not None for v in vectors)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+
+        return vectors
+
+    def put_many(self, texts: list[str], vectors):
+        rows = [(self.key(t), np.asarray(v, dtype='float32').tobytes()) for t, v in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?)', rows)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.
+        }
+
+
+class QueryCache:
+    """In-memory LRU of query embeddings with a time-to-live. Queries are matched
+    ignoring case, surrounding punctuation and repeated whitespace."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, query: str) -> str:
+        return re.sub(r'\s+', ' ', query.casefold()).strip(' .,;:!?"\'')
+
+    def get(self, query: str):
+        key = self.key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, vector = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return vector
+
+    def put(self, query: str, vector):
+        key = self.key(query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class EmbeddingClient:
+    """Runs embedding requests concurrently, shrinking batches the endpoint
+    rejects as too large."""
+
+    def __init__(self, url: str, credentials, max_workers: int = 8, max_instances: int = 250,
+                 max_tokens: int = 20000, max_retries: int = 6):
+        self.url = url
+        self.max_instances = max_instances
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+
+        # AuthorizedSession refreshes the bearer token when it expires
+        self._session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount('https://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+        self._lock = threading.Lock()
+        self._batch_limit = max_instances
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        results = [None] * len(texts)
+        futures = [
+            (batch, self._pool.submit(self._embed_batch, [texts[i] for i in batch]))
+            for batch in self._batches(texts)
+        ]
+
+        for batch, future in futures:
+            for i, vector in zip(batch, future.result()):
+                results[i] = vector
+
+        return results
+
+    def _batches(self, texts: list[str]):
+        batch, tokens = [], 0
+        for i, text in enumerate(texts):
+            # Rough token estimate, ~4 characters per token
+            n = len(text) // 4 + 1
+            if batch and (len(batch) >= self._batch_limit or tokens + n > self.max_tokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(i)
+            tokens += n
+
+        if batch:
+            yield batch
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        attempt = 0
+        while True:
+            response = self._session.post(self.url, json={ "instances": [{"content": text} for text in texts] })
+
+            if response.status_code == 200:
+                with self._lock:
+                    self._batch_limit = min(self.max_instances, self._batch_limit + 1)
+                return [prediction['embeddings']['values'] for prediction in response.json()['predictions']]
+
+            if response.status_code == 400 and len(texts) > 1:
+                # Most likely over the instance or token limit, split and remember
+                with self._lock:
+                    self._batch_limit = max(1, min(self._batch_limit, len(texts)) // 2)
+                mid = len(texts) // 2
+                return self._embed_batch(texts[:mid]) + self._embed_batch(texts[mid:])
+
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                retry_after = response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else min(60., 2 ** attempt)
+                time.sleep(delay + random.uniform(0, 1))
+                attempt += 1
+                continue
+
+            response.raise_for_status()
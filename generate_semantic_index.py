@@ -1,29 +1,18 @@
-from datetime import date
-from datetime import timedelta
-import semantics
-import gmail_tools
-import gmail_tools
-from data_schemas import Email
-
-def generate_index():
-    today_time = date.today()
-    timestep = timedelta(days=5)
-    curr_time = today_time - timedelta(days=365)
-
-
-    while curr_time < today_time:
-        print(curr_time)
-        emails = gmail_tools.keyword_query_inbox('', start=curr_time, end=curr_time + timestep)
-        print(len(emails))
-        
-
-        semantics.add_embeddings(emails)
-        curr_time += timestep
-
-    
-    semantics.save_index()
-
+import argparse
 
 
+# The backfill spawns parse worker processes, and each of them imports this
+# script again. Everything heavy is imported under __main__ so the workers
+# never open the stores or Google services.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill the mail store and semantic index')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--verify', action='store_true', help='check completed windows against Gmail instead')
+    args = parser.parse_args()
 
+    import backfill
 
+    if args.verify:
+        backfill.verify_index(args.days)
+    else:
+        backfill.generate_index(args.days)
@@ -23,10 +23,12 @@ from classification import UserLabelEnum
 import calendar_tools
 import gmail_tools
 import utils
+import services
 
 os.environ["GOOGLE_API_KEY"] = utils.get_json_field('config.json', 'gemini_key')
 
-SYSTEM_PROMPT = f"""You are a helpful AI agent responsible for managing a user's Gmail inbox.
+# Filled in with the current date when a request comes in
+SYSTEM_PROMPT = """You are a helpful AI agent responsible for managing a user's Gmail inbox.
 An AI chatbot is talking to the user and will relay requests to you in order to help the user. 
 
 Your goal:
@@ -39,7 +41,7 @@ Your goal:
 - You must have a tool call in EVERY response.
 
 INFO:
-- Today's date: {calendar_tools.today}
+- Today's date: {today}
 
 Behavior example:
 1. Think through the steps you need to complete the request.
@@ -81,20 +83,23 @@ def keyword_query_inbox(
         keywords: str = Field(..., description="A string containing the space-separated keywords for your query. Should NOT contain email addresses."), 
         subject: str = Field(None, description="A string containing the subject query."), 
         start: date = Field(None, description="A start date for your query"), 
-        end: date = Field(None, description="An end date for your query") 
+        end: date = Field(None, description="An end date for your query"),
+        sender: str = Field(None, description="A name or email address the email must be from."),
+        labels: list[UserLabelEnum] = Field(None, description="Labels the email must have.")
     ):
     """Used to query the user's inbox using keywords. Use when specific words, such as people, places, and things should be contained in the email."""
-    return gmail_tools.keyword_query_inbox(keywords, subject, start, end, None)
+    return gmail_tools.keyword_query_inbox(keywords, subject, start, end, sender, [label.value for label in labels or []])
 
 @tool
 @validate_call
 def semantically_query_inbox(
         query: str = Field(..., description="A string with your semantic query."), 
         start: date = Field(None, description="A start date for your query"), 
-        end: date = Field(None, description="An end date for your query")
+        end: date = Field(None, description="An end date for your query"),
+        rephrasings: list[str] = Field(None, description="Optional alternative phrasings of the same query. They are searched together at no extra cost.")
     ):
     """Used to query the user's inbox using semantics. Use when the general meaning of the query is more important than specific words in it."""
-    return gmail_tools.semantically_query_inbox(query,start,end)
+    return gmail_tools.semantically_query_inbox(query,start,end,rephrasings)
 
 class AskQuestion(BaseModel):
     """Used to ask the chatbot for more information or clarification about the request."""
@@ -183,12 +188,13 @@ workflow.add_edge("ask_question", "agent")
 
 memory = InMemorySaver()
 
-app = workflow.compile(checkpointer=memory)
+services.register('gmail_agent', lambda: workflow.compile(checkpointer=memory))
 
 
 config = {"configurable": {"thread_id": "1"}}
 
 def start_workflow(request: str = None, answer: str = None):
+    app = services.get('gmail_agent')
 
     if answer:
         events = list(app.stream(
@@ -200,7 +206,7 @@ def start_workflow(request: str = None, answer: str = None):
         events = list(app.stream(
             {
                 "messages": [
-                    SystemMessage(content=SYSTEM_PROMPT),
+                    SystemMessage(content=SYSTEM_PROMPT.format(today=calendar_tools.today)),
                     HumanMessage(content=request)
                 ]
             },
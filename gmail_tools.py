@@ -1,37 +1,74 @@
-import base64
 import json
+import queue
+import random
 import re
 import threading
 import time
-import unicodedata
 from data_schemas import Email
 import utils
+import services
 import semantics
+from mail_store import MailStore
+from state_store import StateStore
+from local_db import STATE_DB_PATH
+import message_parsing
+from change_sources import ChangeSource, PollingSource, PushSource
 from typing import Callable, Union
-from datetime import date
-from urllib.parse import urlparse
-from dateutil import parser
+from datetime import date, timedelta
+from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor
 
-from googleapiclient.discovery import build, Resource
+from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError
 
-gmail = None
+MAIL_DB_PATH = './data/mail.db'
+MAX_QUERY_RESULTS = 150
+# Gmail allows 100 calls per batch but throttles big batches, 50 stays under quota
+FETCH_BATCH_SIZE = 50
+FETCH_WORKERS = 4
+FETCH_RETRIES = 5
+# Most ids messages.batchModify accepts in one call
+BATCH_MODIFY_IDS = 1000
+# Tries at handling a batch of new mail before its history is skipped
+HANDLER_ATTEMPTS = 3
+# Flushes a label change is tried in before it is dropped
+LABEL_ATTEMPTS = 3
+# Only the parts of a message that parse_message reads
+_PART_FIELDS = 'mimeType,body/data,parts({})'
+MESSAGE_FIELDS = 'id,historyId,labelIds,payload(headers(name,value),' + _PART_FIELDS.format(_PART_FIELDS.format(_PART_FIELDS.format('mimeType,body/data,parts'))) + ')'
+
+mail_store = MailStore(MAIL_DB_PATH)
+state = StateStore(STATE_DB_PATH)
+_thread_local = threading.local()
+_STOP = object()
+# Called as listener(email_id, added=[...]) or listener(email_id, removed=[...])
+# for label changes read from Gmail history
+label_listeners = []
 label_descriptors = utils.get_json_field('config.json', 'user_labels')
 map_of_labels = { label['name']: label['id'] for label in label_descriptors }
 ids_to_names = { v: k for k, v in map_of_labels.items()}
-user_email = None
 
 
 
 
-def check_label_ids():
+def gmail_service() -> Resource:
+    """The shared Gmail client. Missing labels are created when it is first built."""
+    return services.get('gmail')
+
+
+def lookup_label_id(label_name: str) -> str:
+    gmail_service()
+    return map_of_labels[label_name]
+
+
+def check_label_ids(gmail: Resource):
     response = gmail.users().labels().list(userId='me').execute()
     labels = response.get('labels', [])
     
     label_set = set([label['name'] for label in labels])
     for k in map_of_labels:
         if k not in label_set:
-            id = create_label(k)
+            id = create_label(gmail, k)
             map_of_labels[k] = id
             for i in range(len(label_descriptors)):
                 if label_descriptors[i]['name'] == k:
@@ -41,9 +78,9 @@ def check_label_ids():
 
 
 def add_email_label(email_id: str, label_name: str):
-    label_id = map_of_labels[label_name]
+    label_id = lookup_label_id(label_name)
     try:
-        gmail.users().messages().modify(
+        gmail_service().users().messages().modify(
             userId='me',
             id=email_id,
             body={
@@ -56,6 +93,8 @@ def add_email_label(email_id: str, label_name: str):
             "error": error
         })
     
+    mail_store.update_labels(email_id, added=[label_name])
+
     return json.dumps({
         "status": "success",
         "result": "added label to email",
@@ -66,9 +105,9 @@ def add_email_label(email_id: str, label_name: str):
 
 
 def remove_email_label(email_id: str, label_name: str):
-    label_id = map_of_labels[label_name]
+    label_id = lookup_label_id(label_name)
     try:
-        gmail.users().messages().modify(
+        gmail_service().users().messages().modify(
             userId='me',
             id=email_id,
             body={
@@ -81,6 +120,8 @@ def remove_email_label(email_id: str, label_name: str):
             "error": error
         })
     
+    mail_store.update_labels(email_id, removed=[label_name])
+
     return json.dumps({
         "status": "success",
         "result": "removed label from email",
@@ -88,7 +129,111 @@ def remove_email_label(email_id: str, label_name: str):
         "email_id": email_id
     })
 
-def create_label(label_name: str, color=None):
+
+class LabelQueue:
+    """Batches label changes into messages.batchModify calls. Failed changes
+    are queued again and make flush raise."""
+
+    def __init__(self, max_pending: int = BATCH_MODIFY_IDS, flush_after: float = 2.):
+        self.max_pending = max_pending
+        self.flush_after = flush_after
+        self._lock = threading.Lock()
+        # (label name, adding) -> {email id: (email, failed flushes)}
+        self._pending = {}
+        self._timer = None
+
+    def add(self, email: Email, label_name: str):
+        self._queue(email, label_name, True)
+
+    def remove(self, email: Email, label_name: str):
+        self._queue(email, label_name, False)
+
+    def _queue(self, email: Email, label_name: str, adding: bool):
+        with self._lock:
+            # A queued opposite change is cancelled, label_names only change once Gmail has
+            self._pending.get((label_name, not adding), {}).pop(email.email_id, None)
+            if (label_name in email.label_names) != adding:
+                self._pending.setdefault((label_name, adding), {})[email.email_id] = (email, 0)
+
+            full = sum(map(len, self._pending.values())) >= self.max_pending
+            if not full:
+                self._start_timer()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        failed = 0
+        for (label_name, adding), entries in pending.items():
+            email_ids = list(entries)
+            for i in range(0, len(email_ids), BATCH_MODIFY_IDS):
+                batch = email_ids[i:i + BATCH_MODIFY_IDS]
+                if not _batch_modify(batch, lookup_label_id(label_name), adding):
+                    failed += len(batch)
+                    self._requeue(label_name, adding, {id: entries[id] for id in batch})
+                    continue
+
+                for id in batch:
+                    email = entries[id][0]
+                    if adding and label_name not in email.label_names:
+                        email.label_names.append(label_name)
+                    elif not adding and label_name in email.label_names:
+                        email.label_names.remove(label_name)
+                if adding:
+                    mail_store.update_labels_many(batch, added=[label_name])
+                else:
+                    mail_store.update_labels_many(batch, removed=[label_name])
+
+        if failed:
+            raise RuntimeError(f'{failed} label changes could not be written to Gmail')
+
+    def _requeue(self, label_name: str, adding: bool, entries: dict):
+        with self._lock:
+            for id, (email, failures) in entries.items():
+                if failures + 1 >= LABEL_ATTEMPTS:
+                    print(f'Giving up on {"adding" if adding else "removing"} label {label_name} for email {id}')
+                # Changes queued for the email since then win
+                elif id not in self._pending.get((label_name, not adding), {}):
+                    self._pending.setdefault((label_name, adding), {}).setdefault(id, (email, failures + 1))
+            if self._pending:
+                self._start_timer()
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_after, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except RuntimeError as error:
+            print(error)
+
+
+def _batch_modify(email_ids: list[str], label_id: str, adding: bool) -> bool:
+    body = {"ids": email_ids, "addLabelIds" if adding else "removeLabelIds": [label_id]}
+    for attempt in range(FETCH_RETRIES):
+        try:
+            thread_gmail().users().messages().batchModify(userId='me', body=body).execute()
+            return True
+        except HttpError as error:
+            if error.resp.status not in (429, 500, 503) or attempt == FETCH_RETRIES - 1:
+                print(f'Labelling {len(email_ids)} emails failed: {error}')
+                return False
+            time.sleep(2 ** attempt + random.uniform(0, 1))
+
+
+label_queue = LabelQueue()
+
+
+def create_label(gmail: Resource, label_name: str, color=None):
     label_body = {
         "name": label_name,
         "labelListVisibility": "labelShow",     
@@ -113,53 +258,82 @@ def create_label(label_name: str, color=None):
     return label['id']
 
 def get_backlogged_emails() -> list[Email]:
-    global gmail
-
-    if id := utils.get_json_field('config.json', 'history_id'):
-        new_emails = _retrieve_new_emails(gmail, id)
-        utils.update_json('config.json', 'history_id', gmail.users().getProfile(userId='me').execute()['historyId'])
+    if id := _history_cursor():
+        new_emails, latest_id = _retrieve_new_emails(gmail_service(), id)
+        state.set('history_id', latest_id)
         return new_emails
         
     return []
 
 
-def _retrieve_email_from_id(gmail: Resource, id) -> Email:
-
-    msg_data = gmail.users().messages().get(userId='me', id=id, format='full').execute()
+def fetch_emails(ids: list[str]) -> list[Email]:
+    """Fetches many messages at once, with Gmail batch requests run on several
+    threads. Emails already in the local store are not fetched."""
+
+    found = mail_store.get_emails(ids)
+    missing = [id for id in dict.fromkeys(ids) if id not in found]
+    batches = [missing[i:i + FETCH_BATCH_SIZE] for i in range(0, len(missing), FETCH_BATCH_SIZE)]
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(batches))) as pool:
+            for messages in pool.map(fetch_message_batch, batches):
+                emails = [parse_message(msg_data) for msg_data in messages]
+                mail_store.add_emails(emails)
+                found.update((e.email_id, e) for e in emails)
+
+    return [found[id] for id in ids if id in found]
+
+def thread_gmail() -> Resource:
+    # httplib2 connections aren't thread safe, so each fetch thread builds its own client
+    if not hasattr(_thread_local, 'gmail'):
+        _thread_local.gmail = services.discovery_client('gmail', 'v1', utils.creds)
+    return _thread_local.gmail
+
+def fetch_message_batch(ids: list[str], gone: set = None) -> list[dict]:
+    """Raw messages for `ids`, in order. Ids Gmail no longer has are added to
+    `gone` when it is given, other failures are logged."""
+    service = thread_gmail()
+    results = {}
+    pending = ids
+
+    for attempt in range(FETCH_RETRIES):
+        throttled = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            elif isinstance(exception, HttpError) and exception.resp.status in (429, 500, 503):
+                throttled.append(request_id)
+            elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                # Deleted since it was listed
+                if gone is not None:
+                    gone.add(request_id)
+            else:
+                print(f'Fetching message {request_id} failed: {exception}')
+
+        batch = service.new_batch_http_request(callback=callback)
+        for id in pending:
+            batch.add(
+                service.users().messages().get(userId='me', id=id, format='full', fields=MESSAGE_FIELDS),
+                request_id=id
+            )
+        batch.execute()
 
-    payload = msg_data.get('payload', {})
-    headers = payload.get('headers', [])
+        if not throttled:
+            break
+        if attempt == FETCH_RETRIES - 1:
+            print(f'Gave up on {len(throttled)} throttled messages: {throttled}')
+            break
+        pending = throttled
+        time.sleep(2 ** attempt + random.uniform(0, 1))
 
-    header_dict = {h['name']: h['value'] for h in headers}
+    return [results[id] for id in ids if id in results]
 
-    email_args = {
-        "sender": header_dict['From'],
-        "recipients": header_dict['To'].split(',') if 'To' in header_dict else [],
-        "sentOn": parser.parse(header_dict['Date']).date() if 'Date' in header_dict else date.today(),
-        "subject": header_dict.get('Subject', None),
-        "email_id": id,
-        "label_names": [ids_to_names[l_id] for l_id in msg_data.get('labelIds', []) if l_id in ids_to_names],
-        "text": "null"
-    }
-    email = Email.model_validate(email_args)
-    
-    if s := extract_email_text(payload):
-        body = strip_whitespace(
-          strip_html(
-            strip_urls(
-              strip_invisible_chars(
-                unicodedata.normalize("NFKC",s)
-              )
-            )
-          )
-        ).strip()
-        email.text = re.sub(r'\n+', '\n', body)
-    else:
-        email.text = "null"
-    
-    return email
+def parse_message(msg_data: dict) -> Email:
+    return message_parsing.parse_message(msg_data, ids_to_names)
 
-def _retrieve_new_emails(worker_gmail: Resource, history_id) -> list[Email]:
+def _retrieve_new_emails(worker_gmail: Resource, history_id) -> tuple[list[Email], str]:
+    # Also returns the mailbox's current history id, the cursor for the next call
     new_emails = []
     page_token = None
     while True:
@@ -167,7 +341,7 @@ def _retrieve_new_emails(worker_gmail: Resource, history_id) -> list[Email]:
         results = worker_gmail.users().history().list(
             userId='me',
             startHistoryId=history_id,
-            historyTypes=['messageAdded'],
+            historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
             pageToken=page_token
         ).execute()
 
@@ -177,87 +351,229 @@ def _retrieve_new_emails(worker_gmail: Resource, history_id) -> list[Email]:
         for update in history:
             for message in update.get('messagesAdded', []):
                 new_email_ids.append(message['message']['id'])
+
+            # Keep the local store in step with changes made outside the assistant
+            for change in update.get('labelsAdded', []):
+                mail_store.update_labels(change['message']['id'], added=_label_names(change['labelIds']), history_id=update['id'])
+                for listener in label_listeners:
+                    listener(change['message']['id'], added=_label_names(change['labelIds']))
+            for change in update.get('labelsRemoved', []):
+                mail_store.update_labels(change['message']['id'], removed=_label_names(change['labelIds']), history_id=update['id'])
+                for listener in label_listeners:
+                    listener(change['message']['id'], removed=_label_names(change['labelIds']))
+            mail_store.delete_emails([message['message']['id'] for message in update.get('messagesDeleted', [])])
         
-        for id in new_email_ids:
-            new_emails.append(_retrieve_email_from_id(worker_gmail, id))
+        new_emails += fetch_emails(new_email_ids)
 
         page_token = results.get('nextPageToken')
         if not page_token:
             break
 
-    return new_emails
+    return new_emails, results.get('historyId', history_id)
+
+def _history_cursor() -> str:
+    # Older installs kept the cursor in config.json
+    return state.get('history_id') or utils.get_json_field('config.json', 'history_id')
+
+def _label_names(label_ids: list[str]) -> list[str]:
+    return [ids_to_names[l_id] for l_id in label_ids if l_id in ids_to_names]
+
+
+
+class MailWatcher:
+    """Reads Gmail history whenever `source` reports a change and hands new
+    emails to `func`."""
+
+    def __init__(self, worker_gmail: Resource, source: ChangeSource, func: Callable, *args):
+        self.gmail = worker_gmail
+        self.source = source
+        self.func = func
+        self.args = args
+        self.history_id = None
+        self.retry = 1.
+        # Failed attempts at handling the emails after the current cursor
+        self.failures = 0
+        self._pending = queue.Queue()
+
+    def start(self):
+        self.history_id = _history_cursor() or self.gmail.users().getProfile(userId='me').execute()['historyId']
+        threading.Thread(target=self._run, daemon=True).start()
+        self.source.start(self.notify)
+
+    def stop(self):
+        self.source.stop()
+        self._pending.put(_STOP)
+
+    def notify(self, history_id: str = None):
+        self._pending.put(history_id)
+
+    def _run(self):
+        while True:
+            notices = [self._pending.get()]
+            while not self._pending.empty():
+                notices.append(self._pending.get())
+            if _STOP in notices:
+                return
+
+            known = [int(id) for id in notices if id]
+            if known and len(known) == len(notices) and max(known) <= int(self.history_id):
+                continue
+
+            try:
+                new_emails, latest_id = _retrieve_new_emails(self.gmail, self.history_id)
+            except Exception as error:
+                print(f'Reading mail history failed, retrying in {self.retry:.0f}s: {error}')
+                self._retry_later()
+                continue
+
+            if new_emails:
+                try:
+                    self.func(new_emails, *self.args)
+                except Exception as error:
+                    self.failures += 1
+                    if self.failures < HANDLER_ATTEMPTS:
+                        # The cursor stays put, so the same history is read again
+                        print(f'Handling new mail failed, retrying in {self.retry:.0f}s: {error}')
+                        self._retry_later()
+                        continue
+
+                    # Parked in the state store so one bad batch doesn't stop new mail
+                    ids = [email.email_id for email in new_emails]
+                    print(f'Giving up on new emails {ids} after {HANDLER_ATTEMPTS} attempts: {error}')
+                    state.set('failed_email_ids', (state.get('failed_email_ids') or []) + ids)
+
+            self.failures = 0
+            self.retry = 1.
+            if latest_id != self.history_id:
+                self.history_id = latest_id
+                state.set('history_id', latest_id)
+
+
+    def _retry_later(self):
+        time.sleep(self.retry)
+        self.retry = min(self.retry * 2, 300.)
+        self._pending.put(None)
+
+
+def make_change_source(worker_gmail: Resource) -> ChangeSource:
+    # Push needs a Pub/Sub topic Gmail may publish to, otherwise Gmail is polled
+    topic = utils.get_json_field('config.json', 'pubsub_topic')
+    subscription = utils.get_json_field('config.json', 'pubsub_subscription')
+    if topic and subscription:
+        return PushSource(worker_gmail, topic, subscription)
+    return PollingSource(worker_gmail)
+
+
+def start_email_checking(creds, func: Callable, *args, source: ChangeSource = None) -> MailWatcher:
+    # The watcher and the change source run on their own threads, and httplib2
+    # clients can't be shared between threads, so each gets its own
+    worker_gmail = services.discovery_client('gmail', 'v1', creds)
+    source = source or make_change_source(services.discovery_client('gmail', 'v1', creds))
+    watcher = MailWatcher(worker_gmail, source, func, *args)
+    watcher.start()
+    return watcher
 
+    
+def _open_gmail() -> Resource:
+    gmail = services.discovery_client('gmail', 'v1', utils.creds)
+    check_label_ids(gmail)
+    return gmail
 
 
-def _check_for_new_email(worker_gmail: Resource, func: Callable, *args):
-    
-    latest_id = worker_gmail.users().getProfile(userId='me').execute()['historyId']
-    utils.update_json('config.json', 'history_id', latest_id)
+def _user_email() -> str:
+    return gmail_service().users().getProfile(userId='me').execute()['emailAddress']
 
-    while True:
-        time.sleep(5.)
-        new_id = worker_gmail.users().getProfile(userId='me').execute()['historyId']
-        if latest_id != new_id:
-            if new_emails := _retrieve_new_emails(worker_gmail, latest_id):
-                func(new_emails, *args)
-            latest_id = new_id
-            utils.update_json('config.json', 'history_id', latest_id)
-            
-        
-def start_email_checking(creds, func: Callable, *args):
-    worker_gmail = build('gmail', 'v1', credentials=creds)
-    thread = threading.Thread(target=_check_for_new_email, daemon=True, args=(worker_gmail, func, *args))
-    thread.start()
 
-    
-def init_gmail(creds):
-    global gmail, user_email, map_of_labels
+def __getattr__(name: str):
+    # Kept for callers of the old module globals, built on first read
+    if name in ('gmail', 'user_email'):
+        return services.get(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-    gmail = build('gmail', 'v1', credentials=creds)
-    user_email = gmail.users().getProfile(userId='me').execute()['emailAddress']
-    check_label_ids()
 
 
+def build_gmail_query(keywords: str = '', subject: str = None, start: date = None, end: date = None,
+                sender: str = None, labels: list[str] = None) -> str:
+    terms = [_quote_term(word) for word in keywords.split()]
 
-def keyword_query_inbox(keywords: str, subject: str = None, start: date = None, end: date = None, 
-                sender: str = None) -> list[Email]:
-    
-    subject_query = '' if subject is None else f'subject:{subject} '
-    start_query = '' if start is None else f'after:{start.strftime("%Y/%m/%d")} '
-    end_query = '' if end is None else f'before:{end.strftime("%Y/%m/%d")} '
-    sender_query = '' if sender is None else f'from:{sender} '
-    query = start_query + end_query 
-    
-    results = gmail.users().messages().list(userId='me', q=query, maxResults=150).execute()
+    if subject:
+        terms.append(f'subject:({" ".join(_quote_term(word) for word in subject.split())})')
+    if sender:
+        terms.append(f'from:{_quote_term(sender)}')
+    for label in labels or []:
+        terms.append(f'label:{_quote_term(label)}')
+    if start:
+        terms.append(f'after:{start.strftime("%Y/%m/%d")}')
+    if end:
+        terms.append(f'before:{end.strftime("%Y/%m/%d")}')
+
+    return ' '.join(terms)
 
-    messages = results.get('messages', [])
-    msgs = [msg['id'] for msg in messages]
+def _quote_term(term: str) -> str:
+    # Gmail treats a few characters as operators, anything containing them is quoted
+    if re.search(r'[\s"():{}\-]', term):
+        return '"' + term.replace('"', '') + '"'
+    return term
 
-    query_results = []
+def iter_message_ids(query: str, limit: int = None, service: Resource = None):
+    """Lazily yields ids of messages matching `query`, following nextPageToken
+    until Gmail runs out of results or `limit` ids have been produced."""
 
-    for msg in msgs:
-        email = _retrieve_email_from_id(gmail, msg)
-        query_results.append(email)
+    service = service or gmail_service()
+    page_token = None
+    produced = 0
+    while limit is None or produced < limit:
+        page_size = 500 if limit is None else min(500, limit - produced)
+        results = service.users().messages().list(userId='me', q=query, maxResults=page_size, pageToken=page_token).execute()
 
-    return query_results
+        for msg in results.get('messages', []):
+            yield msg['id']
+            produced += 1
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+def iter_query_emails(query: str, limit: int = None):
+    # Fetches each page worth of ids as it arrives rather than listing everything first
+    ids = []
+    for id in iter_message_ids(query, limit):
+        ids.append(id)
+        if len(ids) == FETCH_BATCH_SIZE * FETCH_WORKERS:
+            yield from fetch_emails(ids)
+            ids = []
+    if ids:
+        yield from fetch_emails(ids)
+
+def keyword_query_inbox(keywords: str, subject: str = None, start: date = None, end: date = None, 
+                sender: str = None, labels: list[str] = None, limit: int = MAX_QUERY_RESULTS) -> list[Email]:
+
+    # Ranges that have been fully ingested are answered from the local index
+    if start and mail_store.covers(start, (end or date.today()) - timedelta(days=1)):
+        return mail_store.search(keywords, subject, start, end, sender, labels, limit=limit)
+
+    return list(iter_query_emails(build_gmail_query(keywords, subject, start, end, sender, labels), limit))
    
     
 
-def semantically_query_inbox(query: str, start: date = None, end: date = None) -> dict:
+def semantically_query_inbox(query: str, start: date = None, end: date = None, rephrasings: list[str] = None) -> dict:
 
-    email_ids = semantics.query_index(query, 5, start, end)
-    seen = set()
-    i = 0
+    # Alternative phrasings share one embedding request, results are interleaved
+    results = semantics.query_index_batch([query] + (rephrasings or []), 5, start, end)
 
-    while i < len(email_ids):
-        if email_ids[i] in seen:
-            del email_ids[i]
-        else:
-            seen.add(email_ids[i])
-            i += 1
+    matches = {}
+    for ranked in zip_longest(*results):
+        for match in filter(None, ranked):
+            matches.setdefault(match['email_id'], match)
 
-
-    emails = [_retrieve_email_from_id(gmail, e_id).to_dict() for e_id in email_ids]
+    matches = list(matches.values())[:5]
+    fetched = { e.email_id: e for e in fetch_emails([match['email_id'] for match in matches]) }
+    emails = []
+    for match in matches:
+        if match['email_id'] in fetched:
+            email = fetched[match['email_id']].to_dict()
+            email['matched_chunk_offset'] = match['chunk_offset']
+            emails.append(email)
 
     
     return json.dumps({
@@ -266,54 +582,8 @@ def semantically_query_inbox(query: str, start: date = None, end: date = None) -
         "emails": emails
     }, indent=2)
 
-def strip_urls(text: str) -> str:
-    return re.sub(r'https?://[^\s]+',replace_helper, text)
-
-def strip_html(html: str) -> str:
-    newline_tags = r'</?(p|div|br|li|ul|ol|tr|h[1-6])[^>]*>'
-    text = re.sub(newline_tags, '\n', html, flags=re.IGNORECASE)
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'(&zwnj;)+', '', text)
-    return text
-
-def replace_helper(match: re.Match) -> str:
-    url = match.group()
-    try:
-        domain = urlparse(url).netloc
-    except Exception as error:
-        return ""
-    return domain.removeprefix("www.")
-
-def extract_email_text(part):
-    if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
-        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='replace')
-    elif 'parts' in part:
-        for sub_part in part['parts']:
-            body = extract_email_text(sub_part)
-            if body:
-                return body
-    return None
-
-def strip_whitespace(text: str) -> str:
-    return re.sub(r'\n +', "\n", re.sub(r'(?:\r\n)+', "\n", re.sub(r'( |\t)+', " ", text)))
-
-def strip_invisible_chars(text: str) -> str:
-    # Matches zero-width joiner, zero-width non-joiner, non-breaking space, etc.
-    invisible_chars = [
-        '\u034f',  # combining grapheme joiner
-        '\u200b',  # zero-width space
-        '\u200c',  # zero-width non-joiner
-        '\u200d',  # zero-width joiner
-        '\u2060',  # word joiner
-        '\ufeff',  # BOM
-        '\u00a0',  # non-breaking space
-        '\u2019',
-        '\u2013'
-    ]
-    pattern = "[" + "".join(invisible_chars) + "]"
-    return re.sub(pattern, "", text)
-
-init_gmail(utils.creds)
+services.register('gmail', _open_gmail)
+services.register('user_email', _user_email)
   
 
 
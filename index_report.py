@@ -0,0 +1,11 @@
+import semantics
+
+
+def print_recall_report(k: int = 10):
+    print(f'{"dims":>5} {"storage":<8} {"bytes/vec":>10} {"recall@" + str(k):>10} {"reranked":>10}')
+    for row in semantics.recall_report(k):
+        print(f'{row["dims"]:>5} {row["storage"]:<8} {row["bytes_per_vector"]:>10.0f} {row["recall"]:>10.3f} {row["recall_reranked"]:>10.3f}')
+
+
+if __name__ == '__main__':
+    print_recall_report()
@@ -0,0 +1,135 @@
+import atexit
+import os
+import threading
+import time
+
+import numpy as np
+
+
+# Neighbours compare the leading dimensions of the Matryoshka embeddings
+KNN_DIMS = 256
+KNN_K = 15
+# Below this many examples every email goes to the LLM
+MIN_EXAMPLES = 50
+MAX_EXAMPLES = 20000
+SAVE_EVERY = 60.
+
+
+class KnnLabelModel:
+    """Predicts labels by weighted votes of the nearest labelled emails, only
+    when the winner's share of the votes reaches `threshold`."""
+
+    def __init__(self, path: str, labels, threshold: float = .8):
+        self.path = path
+        self.labels = set(labels)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._saved_at = time.monotonic()
+        self._dirty = False
+
+        self.email_ids = []
+        self.example_labels = []
+        self.vectors = np.empty((0, KNN_DIMS), dtype='float32')
+        if os.path.exists(path):
+            data = np.load(path)
+            self.email_ids = data['email_ids'].tolist()
+            self.example_labels = data['labels'].tolist()
+            self.vectors = data['vectors']
+        self._rows = {email_id: i for i, email_id in enumerate(self.email_ids)}
+
+        atexit.register(self.save)
+
+    def __len__(self):
+        return len(self.email_ids)
+
+    def predict(self, vectors: np.ndarray) -> list[str]:
+        """A label or None for each row of `vectors`."""
+        with self._lock:
+            if len(self.email_ids) < MIN_EXAMPLES:
+                return [None] * len(vectors)
+            examples, labels = self.vectors, np.array(self.example_labels)
+
+        sims = _prefix(vectors) @ examples.T
+        k = min(KNN_K, len(labels))
+        nearest = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+        predictions = []
+        for row, idx in zip(sims, nearest):
+            votes = {}
+            for label, weight in zip(labels[idx], np.maximum(row[idx], 0)):
+                votes[label] = votes.get(label, 0.) + weight
+            best = max(votes, key=votes.get)
+            total = sum(votes.values())
+            predictions.append(str(best) if total and votes[best] / total >= self.threshold else None)
+        return predictions
+
+    def learn(self, email_ids: list[str], vectors: np.ndarray, labels: list[str]):
+        vectors = _prefix(vectors)
+        with self._lock:
+            new = {}
+            for email_id, vector, label in zip(email_ids, vectors, labels):
+                if label not in self.labels:
+                    continue
+                if email_id in self._rows:
+                    row = self._rows[email_id]
+                    self.vectors[row] = vector
+                    self.example_labels[row] = label
+                else:
+                    new[email_id] = (label, vector)
+
+            if new:
+                self.email_ids += list(new)
+                self.example_labels += [label for label, _ in new.values()]
+                self.vectors = np.vstack([self.vectors, np.array([v for _, v in new.values()], dtype='float32')])
+                # The oldest examples make way for new ones
+                if len(self.email_ids) > MAX_EXAMPLES:
+                    self._keep(np.arange(len(self.email_ids) - MAX_EXAMPLES, len(self.email_ids)))
+                self._rows = {email_id: i for i, email_id in enumerate(self.email_ids)}
+            self._dirty = True
+
+        self._save_if_due()
+
+    def relabel(self, email_id: str, added: list[str] = (), removed: list[str] = ()):
+        """Follows a label change made in Gmail. Only emails already learned can
+        be relabelled, their vector is kept."""
+        with self._lock:
+            row = self._rows.get(email_id)
+            if row is None:
+                return
+            for label in added:
+                if label in self.labels:
+                    self.example_labels[row] = label
+                    self._dirty = True
+            if self.example_labels[row] in removed:
+                keep = np.ones(len(self.email_ids), dtype=bool)
+                keep[row] = False
+                self._keep(np.flatnonzero(keep))
+                self._rows = {email_id: i for i, email_id in enumerate(self.email_ids)}
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            # np.savez adds .npz to names without it
+            tmp = self.path + '.tmp.npz'
+            np.savez(tmp, email_ids=np.array(self.email_ids, dtype=str),
+                     labels=np.array(self.example_labels, dtype=str), vectors=self.vectors)
+            os.replace(tmp, self.path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def _save_if_due(self):
+        if time.monotonic() - self._saved_at > SAVE_EVERY:
+            self.save()
+
+    def _keep(self, rows: np.ndarray):
+        self.email_ids = [self.email_ids[i] for i in rows]
+        self.example_labels = [self.example_labels[i] for i in rows]
+        self.vectors = self.vectors[rows]
+
+
+def _prefix(vectors: np.ndarray) -> np.ndarray:
+    prefix = np.ascontiguousarray(np.asarray(vectors, dtype='float32')[:, :KNN_DIMS])
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.where(norms == 0, 1, norms)
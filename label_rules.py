@@ -0,0 +1,118 @@
+import hashlib
+import re
+import threading
+
+from data_schemas import Email
+from local_db import connect
+
+
+# A list's label is reused once this many of its emails in a row got it
+LIST_AGREEMENT = 3
+
+
+class LabelRules:
+    """Labels emails from the label_rules config. A rule has a `label` plus any of
+    `sender_domain`, `sender`, `subject`, `header` and `pattern`; the first match wins."""
+
+    def __init__(self, rules: list[dict], labels):
+        self.domains = {}
+        self.rules = []
+
+        for order, rule in enumerate(rules):
+            if rule.get('label') not in labels:
+                print(f'Skipping label rule for unknown label: {rule}')
+                continue
+
+            if set(rule) == {'label', 'sender_domain'}:
+                self.domains.setdefault(rule['sender_domain'].lower().lstrip('@'), (order, rule['label']))
+                continue
+
+            checks = []
+            if 'sender_domain' in rule:
+                domain = rule['sender_domain'].lower().lstrip('@')
+                checks.append(lambda email, domain=domain: domain in _domains(email.sender))
+            if 'sender' in rule:
+                checks.append(lambda email, p=re.compile(rule['sender'], re.IGNORECASE): bool(p.search(email.sender or '')))
+            if 'subject' in rule:
+                checks.append(lambda email, p=re.compile(rule['subject'], re.IGNORECASE): bool(p.search(email.subject or '')))
+            if 'header' in rule:
+                name = rule['header'].lower()
+                pattern = re.compile(rule.get('pattern', ''), re.IGNORECASE)
+                checks.append(lambda email, name=name, p=pattern: name in (email.headers or {}) and bool(p.search(email.headers[name])))
+            self.rules.append((order, rule['label'], checks))
+
+    def match(self, email: Email) -> str:
+        best = None
+        for domain in _domains(email.sender):
+            if domain in self.domains and (best is None or self.domains[domain] < best):
+                best = self.domains[domain]
+
+        for order, label, checks in self.rules:
+            if best is not None and order > best[0]:
+                break
+            if all(check(email) for check in checks):
+                return label
+
+        return best[1] if best else None
+
+
+def _domains(sender: str) -> list[str]:
+    # 'Name <a@mail.linkedin.com>' -> mail.linkedin.com, linkedin.com, com
+    found = re.findall(r'@([\w.-]+)', sender or '')
+    if not found:
+        return []
+    parts = found[-1].lower().strip('.').split('.')
+    return ['.'.join(parts[i:]) for i in range(len(parts))]
+
+
+class VerdictCache:
+    """Labels given before, keyed by email content and by mailing list."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS content_verdicts (key BLOB PRIMARY KEY, label TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS list_verdicts (key TEXT PRIMARY KEY, label TEXT NOT NULL, streak INTEGER NOT NULL);
+        """)
+        self._conn.commit()
+
+    def get_many(self, emails: list[Email]) -> list[str]:
+        labels = []
+        with self._lock:
+            for email in emails:
+                row = self._conn.execute('SELECT label FROM content_verdicts WHERE key = ?', (_content_key(email),)).fetchone()
+                if row is None and (key := _list_key(email)):
+                    row = self._conn.execute(
+                        'SELECT label FROM list_verdicts WHERE key = ? AND streak >= ?', (key, LIST_AGREEMENT)
+                    ).fetchone()
+                labels.append(row[0] if row else None)
+        return labels
+
+    def put_many(self, emails: list[Email], labels: list[str]):
+        with self._lock:
+            for email, label in zip(emails, labels):
+                self._conn.execute('INSERT OR REPLACE INTO content_verdicts VALUES (?, ?)', (_content_key(email), label))
+                if key := _list_key(email):
+                    # The streak restarts whenever the list gets a different label
+                    self._conn.execute("""
+                        INSERT INTO list_verdicts VALUES (?, ?, 1)
+                        ON CONFLICT (key) DO UPDATE SET
+                            streak = CASE WHEN label = excluded.label THEN streak + 1 ELSE 1 END,
+                            label = excluded.label
+                    """, (key, label))
+            self._conn.commit()
+
+
+def _content_key(email: Email) -> bytes:
+    return hashlib.sha256(f'{email.sender}\0{email.subject}\0{email.text}'.encode('utf-8')).digest()
+
+
+def _list_key(email: Email) -> str:
+    headers = email.headers or {}
+    if 'list-id' in headers:
+        return 'list:' + headers['list-id'].lower()
+    if 'list-unsubscribe' in headers or headers.get('precedence', '').lower() in ('bulk', 'list', 'junk'):
+        found = re.findall(r'[\w.+-]+@[\w.-]+', email.sender or '')
+        return 'sender:' + found[-1].lower() if found else None
+    return None
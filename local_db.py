@@ -0,0 +1,21 @@
+import os
+import sqlite3
+
+
+# Runtime state and label verdicts share one database
+STATE_DB_PATH = './data/state.db'
+# Ids per query, under SQLite's bound parameter limit
+MAX_PARAMS = 500
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # Shared between threads, each store guards it with its own lock
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def batches(items: list, size: int = MAX_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
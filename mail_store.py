@@ -0,0 +1,244 @@
+import json
+import threading
+
+from datetime import date, timedelta
+from data_schemas import Email
+from local_db import batches, connect
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    email_id TEXT PRIMARY KEY,
+    sender TEXT,
+    subject TEXT,
+    sent_on TEXT,
+    labels TEXT,
+    text TEXT,
+    recipients TEXT,
+    history_id TEXT,
+    headers TEXT
+);
+CREATE INDEX IF NOT EXISTS emails_sent_on ON emails (sent_on);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+    sender, subject, labels, text,
+    content='emails', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS emails_ai AFTER INSERT ON emails BEGIN
+    INSERT INTO emails_fts (rowid, sender, subject, labels, text) VALUES (new.rowid, new.sender, new.subject, new.labels, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS emails_ad AFTER DELETE ON emails BEGIN
+    INSERT INTO emails_fts (emails_fts, rowid, sender, subject, labels, text) VALUES ('delete', old.rowid, old.sender, old.subject, old.labels, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE ON emails BEGIN
+    INSERT INTO emails_fts (emails_fts, rowid, sender, subject, labels, text) VALUES ('delete', old.rowid, old.sender, old.subject, old.labels, old.text);
+    INSERT INTO emails_fts (rowid, sender, subject, labels, text) VALUES (new.rowid, new.sender, new.subject, new.labels, new.text);
+END;
+
+CREATE TABLE IF NOT EXISTS indexed_ranges (start TEXT, end TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Columns added after the first version of the schema
+ADDED_COLUMNS = { 'recipients': 'TEXT', 'history_id': 'TEXT', 'headers': 'TEXT' }
+
+EMAIL_COLUMNS = 'e.email_id, e.sender, e.subject, e.sent_on, e.labels, e.text, e.recipients, e.history_id, e.headers'
+
+# bm25 column weights for sender, subject, labels, text
+BM25_WEIGHTS = (5.0, 10.0, 2.0, 1.0)
+
+
+class MailStore:
+    """Local copy of parsed emails with an FTS5 index, kept fresh from Gmail history."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+
+        existing = {row[1] for row in self._conn.execute('PRAGMA table_info(emails)')}
+        for column, kind in ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f'ALTER TABLE emails ADD COLUMN {column} {kind}')
+
+        # Labels used to be stored space separated, which split multi-word names
+        rows = self._conn.execute("SELECT email_id, labels FROM emails WHERE labels NOT LIKE '[%'").fetchall()
+        self._conn.executemany(
+            'UPDATE emails SET labels = ? WHERE email_id = ?', [(json.dumps((labels or '').split()), e_id) for e_id, labels in rows]
+        )
+        self._conn.commit()
+
+    def add_emails(self, emails: list[Email]):
+        rows = [
+            (e.email_id, e.sender, e.subject, e.sentOn.isoformat(), json.dumps(e.label_names or []), e.text,
+             json.dumps(e.recipients or []), e.history_id, json.dumps(e.headers or {}))
+            for e in emails
+        ]
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO emails (email_id, sender, subject, sent_on, labels, text, recipients, history_id, headers)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (email_id) DO UPDATE SET
+                    sender = excluded.sender, subject = excluded.subject, sent_on = excluded.sent_on,
+                    labels = excluded.labels, text = excluded.text, recipients = excluded.recipients,
+                    history_id = excluded.history_id, headers = excluded.headers
+            """, rows)
+            self._conn.commit()
+
+    def get_emails(self, email_ids: list[str]) -> dict[str, Email]:
+        found = {}
+        with self._lock:
+            for batch in batches(email_ids):
+                rows = self._conn.execute(
+                    f'SELECT {EMAIL_COLUMNS} FROM emails e WHERE e.email_id IN ({",".join("?" * len(batch))})', batch
+                ).fetchall()
+                found.update((row[0], _to_email(row)) for row in rows)
+        return found
+
+    def get_email(self, email_id: str) -> Email:
+        return self.get_emails([email_id]).get(email_id)
+
+    def update_labels(self, email_id: str, added: list[str] = (), removed: list[str] = (), history_id: str = None):
+        with self._lock:
+            row = self._conn.execute('SELECT labels FROM emails WHERE email_id = ?', (email_id,)).fetchone()
+            if row is None:
+                return
+
+            labels = [l for l in json.loads(row[0] or '[]') if l not in removed]
+            labels += [l for l in added if l not in labels]
+            self._conn.execute(
+                'UPDATE emails SET labels = ?, history_id = COALESCE(?, history_id) WHERE email_id = ?',
+                (json.dumps(labels), history_id, email_id)
+            )
+            self._conn.commit()
+
+    def update_labels_many(self, email_ids: list[str], added: list[str] = (), removed: list[str] = ()):
+        # One transaction for a whole batch of emails given the same change
+        with self._lock:
+            for batch in batches(email_ids):
+                rows = self._conn.execute(
+                    f'SELECT email_id, labels FROM emails WHERE email_id IN ({",".join("?" * len(batch))})', batch
+                ).fetchall()
+
+                updates = []
+                for email_id, labels in rows:
+                    labels = [l for l in json.loads(labels or '[]') if l not in removed]
+                    labels += [l for l in added if l not in labels]
+                    updates.append((json.dumps(labels), email_id))
+                self._conn.executemany('UPDATE emails SET labels = ? WHERE email_id = ?', updates)
+            self._conn.commit()
+
+    def delete_emails(self, email_ids: list[str]):
+        with self._lock:
+            self._conn.executemany('DELETE FROM emails WHERE email_id = ?', [(e_id,) for e_id in email_ids])
+            self._conn.commit()
+
+    def mark_indexed(self, start: date, end: date):
+        """Records that every email sent in [start, end] has been added."""
+        with self._lock:
+            ranges = self._conn.execute('SELECT start, end FROM indexed_ranges').fetchall()
+            ranges = [(date.fromisoformat(s), date.fromisoformat(e)) for s, e in ranges] + [(start, end)]
+
+            merged = []
+            for s, e in sorted(ranges):
+                if merged and s <= merged[-1][1] + timedelta(days=1):
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+                else:
+                    merged.append((s, e))
+
+            self._conn.execute('DELETE FROM indexed_ranges')
+            self._conn.executemany('INSERT INTO indexed_ranges VALUES (?, ?)', [(s.isoformat(), e.isoformat()) for s, e in merged])
+            self._conn.commit()
+
+    def clear_indexed(self, start: date, end: date):
+        """Forgets that [start, end] is complete, so it is ingested again."""
+        with self._lock:
+            ranges = self._conn.execute('SELECT start, end FROM indexed_ranges').fetchall()
+            kept = []
+            for s, e in ranges:
+                s, e = date.fromisoformat(s), date.fromisoformat(e)
+                if s < start:
+                    kept.append((s, min(e, start - timedelta(days=1))))
+                if e > end:
+                    kept.append((max(s, end + timedelta(days=1)), e))
+
+            self._conn.execute('DELETE FROM indexed_ranges')
+            self._conn.executemany('INSERT INTO indexed_ranges VALUES (?, ?)', [(s.isoformat(), e.isoformat()) for s, e in kept])
+            self._conn.commit()
+
+    def covers(self, start: date, end: date) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM indexed_ranges WHERE start <= ? AND end >= ?', (start.isoformat(), end.isoformat())
+            ).fetchone()
+        return row is not None
+
+    def sync_checkpoint(self, today: date):
+        """Marks the days since the previous checkpoint as complete, starting the
+        day after the first one."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'last_sync'").fetchone()
+            start = date.fromisoformat(row[0]) if row else today + timedelta(days=1)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_sync', ?)", (max(start, today).isoformat(),))
+            self._conn.commit()
+
+        if start <= today:
+            self.mark_indexed(start, today)
+
+    def search(self, keywords: str = '', subject: str = None, start: date = None, end: date = None,
+               sender: str = None, labels: list[str] = None, limit: int = 150) -> list[Email]:
+        # Same semantics as the Gmail query: every term must match, `end` is exclusive
+        terms = [_quote(t) for t in keywords.split()]
+        if subject:
+            terms += [f'subject : {_quote(t)}' for t in subject.split()]
+        if sender:
+            terms += [f'sender : {_quote(t)}' for t in sender.split()]
+
+        where, args = [], []
+        # Labels match whole names, not FTS tokens, so 'action' never matches 'needs_action'
+        for label in labels or []:
+            where.append('EXISTS (SELECT 1 FROM json_each(e.labels) WHERE value = ?)')
+            args.append(label)
+        if start:
+            where.append('e.sent_on >= ?')
+            args.append(start.isoformat())
+        if end:
+            where.append('e.sent_on < ?')
+            args.append(end.isoformat())
+
+        if terms:
+            sql = f"""
+                SELECT {EMAIL_COLUMNS}
+                FROM emails_fts JOIN emails e ON e.rowid = emails_fts.rowid
+                WHERE emails_fts MATCH ? {''.join(' AND ' + w for w in where)}
+                ORDER BY bm25(emails_fts, {', '.join(map(str, BM25_WEIGHTS))}) LIMIT ?
+            """
+            args = [' '.join(terms)] + args
+        else:
+            sql = f"""
+                SELECT {EMAIL_COLUMNS} FROM emails e
+                {'WHERE ' + ' AND '.join(where) if where else ''}
+                ORDER BY e.sent_on DESC LIMIT ?
+            """
+
+        with self._lock:
+            rows = self._conn.execute(sql, args + [limit]).fetchall()
+
+        return [_to_email(row) for row in rows]
+
+
+def _to_email(row) -> Email:
+    email_id, sender, subject, sent_on, labels, text, recipients, history_id, headers = row
+    fields = dict(
+        email_id=email_id, sender=sender, subject=subject, sentOn=date.fromisoformat(sent_on),
+        label_names=json.loads(labels) if labels else [], text=text,
+        recipients=json.loads(recipients) if recipients else [], history_id=history_id,
+        headers=json.loads(headers) if headers else {}
+    )
+    # NULL columns, e.g. ones added to the schema later, fall back to the field defaults
+    return Email(**{name: value for name, value in fields.items() if value is not None})
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
@@ -0,0 +1,118 @@
+import base64
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from dateutil import parser
+
+from data_schemas import Email
+from text_cleaning import normalize_email_text
+
+
+# Chunks overlap by 100 characters
+CHUNK_SIZE = 1000
+CHUNK_STRIDE = 900
+
+# Headers kept on each Email for label rules, the rest are dropped
+RULE_HEADERS = {
+    'list-id', 'list-unsubscribe', 'list-post', 'precedence', 'auto-submitted',
+    'reply-to', 'x-mailer', 'feedback-id'
+}
+
+# Label id to name map of a worker process, sent once when it starts
+_worker_labels = {}
+
+
+def extract_email_text(part):
+    if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
+        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='replace')
+    elif 'parts' in part:
+        for sub_part in part['parts']:
+            body = extract_email_text(sub_part)
+            if body:
+                return body
+    return None
+
+
+def parse_message(msg_data: dict, ids_to_names: dict[str, str]) -> Email:
+
+    payload = msg_data.get('payload', {})
+    headers = payload.get('headers', [])
+
+    header_dict = {h['name']: h['value'] for h in headers}
+
+    email_args = {
+        "sender": header_dict['From'],
+        "recipients": header_dict['To'].split(',') if 'To' in header_dict else [],
+        "sentOn": parser.parse(header_dict['Date']).date() if 'Date' in header_dict else date.today(),
+        "subject": header_dict.get('Subject', None),
+        "email_id": msg_data['id'],
+        "label_names": [ids_to_names[l_id] for l_id in msg_data.get('labelIds', []) if l_id in ids_to_names],
+        "text": "null",
+        "history_id": msg_data.get('historyId'),
+        "headers": {name.lower(): value for name, value in header_dict.items() if name.lower() in RULE_HEADERS}
+    }
+    email = Email.model_validate(email_args)
+
+    if s := extract_email_text(payload):
+        email.text = normalize_email_text(s)
+    else:
+        email.text = "null"
+
+    return email
+
+
+def chunk_email(email: Email) -> list[str]:
+    email_txt = email.model_dump_json(exclude={'sentOn', 'email_id'})
+    return [email_txt[i: i + CHUNK_SIZE] for i in range(0, len(email.text), CHUNK_STRIDE)]
+
+
+def split_texts(emails: list[Email]):
+
+    embedding_map = ([], [])
+    for email in emails:
+        for i, chunk in enumerate(chunk_email(email)):
+            embedding_map[0].append((email.sentOn, email.email_id, i * CHUNK_STRIDE))
+            embedding_map[1].append(chunk)
+
+    return embedding_map
+
+
+class ParsePool:
+    """Parses and chunks raw messages on spawned worker processes, which import
+    the parent's __main__ again, so start it from a script with light imports."""
+
+    def __init__(self, ids_to_names: dict[str, str], workers: int = None):
+        # Spawned rather than forked, the ingesting process runs threads
+        self._executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(ids_to_names,)
+        )
+
+    def parse(self, messages: list[dict]) -> list[tuple[Email, list[str]]]:
+        if not messages:
+            return []
+        parsed = self._executor.submit(_parse_batch, messages).result()
+        return [(Email.model_construct(**fields), chunks) for fields, chunks in parsed]
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _init_worker(ids_to_names: dict[str, str]):
+    global _worker_labels
+    _worker_labels = ids_to_names
+
+
+def _parse_batch(messages: list[dict]) -> list[tuple[dict, list[str]]]:
+    parsed = []
+    for msg_data in messages:
+        email = parse_message(msg_data, _worker_labels)
+        parsed.append((dict(email), chunk_email(email)))
+    return parsed
@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+from typing import Callable, Iterable
+
+
+_DONE = object()
+
+
+class Stage:
+    """A pipeline step running `func` on `workers` threads, fed by a bounded queue."""
+
+    def __init__(self, name: str, func: Callable, workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.
+        self._lock = threading.Lock()
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "stage": self.name,
+            "in": self.items_in,
+            "out": self.items_out,
+            "per_sec": self.items_in / elapsed if elapsed else 0.,
+            "busy": self.busy / (elapsed * self.workers) if elapsed else 0.,
+            "queued": self.inbox.qsize()
+        }
+
+
+class Pipeline:
+    """Runs every stage concurrently, connected by bounded queues."""
+
+    def __init__(self, source: Iterable, stages: list[Stage], report_every: float = 30.):
+        self.source = source
+        self.stages = stages
+        self.report_every = report_every
+        self.error = None
+        self._stop = threading.Event()
+        self._started = None
+
+    def run(self):
+        self._started = time.monotonic()
+        threads = []
+
+        for i, stage in enumerate(self.stages):
+            downstream = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(stage, downstream, remaining), daemon=True))
+
+        reporter = threading.Thread(target=self._report_loop, daemon=True)
+
+        for thread in threads:
+            thread.start()
+        reporter.start()
+
+        try:
+            for item in self.source:
+                if self._stop.is_set():
+                    break
+                self._put(self.stages[0], item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._put(self.stages[0], _DONE, force=True)
+
+        for thread in threads:
+            thread.join()
+        self._stop.set()
+
+        self.report()
+        if self.error:
+            raise self.error
+
+    def stats(self) -> list[dict]:
+        elapsed = time.monotonic() - self._started
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def report(self):
+        for s in self.stats():
+            print(f'{s["stage"]:<10} in={s["in"]:<8} out={s["out"]:<8} {s["per_sec"]:8.1f}/s busy={s["busy"]:5.0%} queued={s["queued"]}')
+
+    def _put(self, stage: Stage, item, force: bool = False):
+        # Blocks while the stage is full, but drops items after a failure. Workers
+        # keep draining their queues until the end marker, so forced puts finish.
+        while True:
+            try:
+                stage.inbox.put(item, timeout=.5)
+                return
+            except queue.Full:
+                if self._stop.is_set() and not force:
+                    return
+
+    def _work(self, stage: Stage, downstream: Stage, remaining: list):
+        while True:
+            item = stage.inbox.get()
+            if item is _DONE:
+                break
+            if self._stop.is_set():
+                continue
+
+            start = time.monotonic()
+            try:
+                outputs = list(stage.func(item) or [])
+            except Exception as error:
+                print(f'Pipeline stage {stage.name} failed: {error}')
+                self.error = error
+                self._stop.set()
+                continue
+
+            with stage._lock:
+                stage.items_in += 1
+                stage.items_out += len(outputs)
+                stage.busy += time.monotonic() - start
+
+            if downstream:
+                for output in outputs:
+                    self._put(downstream, output)
+
+        # The last worker of a stage to finish passes the end marker along
+        with stage._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and downstream:
+            for _ in range(downstream.workers):
+                self._put(downstream, _DONE, force=True)
+
+    def _report_loop(self):
+        while not self._stop.wait(self.report_every):
+            self.report()
@@ -1,104 +1,543 @@
 from data_schemas import Email
-from datetime import date
+from datetime import date, timedelta
+import calendar
 import numpy as np
 
 import faiss
-import requests
+import json
 import os
+import threading
 import google.auth
 
-from google.auth.transport.requests import Request
-import pandas as pd
 import utils
-
-# Get credentials
-creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-creds.refresh(Request())
+import services
+from vector_store import VectorStore, LEGACY_PARQUET
+from embeddings import EmbeddingCache, EmbeddingClient, QueryCache
+from message_parsing import split_texts
 
 EMBEDDING_SIZE = 3072
+INDEX_PATH = './data/index.faiss'
+STORE_DIR = './data/vectors'
+# 'month' or 'week', set with the 'shard_period' field of config.json
+SHARD_PERIOD = utils.get_json_field('config.json', 'shard_period') or 'month'
+EMBEDDING_CACHE_PATH = './data/embedding_cache.db'
+EMBEDDING_MODEL = 'gemini-embedding-001'
+
+# 'hnsw' or 'ivf', set with the 'index_type' field of config.json
+INDEX_TYPE = utils.get_json_field('config.json', 'index_type') or 'hnsw'
+HNSW_M = 32
+HNSW_EF_SEARCH = 128
+IVF_NLIST = 256
+IVF_NPROBE = 16
+# How vectors are held inside the index: 'flat' (float32), 'fp16', 'int8' or
+# 'pq', set with the 'index_storage' field of config.json
+INDEX_STORAGE = utils.get_json_field('config.json', 'index_storage') or 'flat'
+PQ_SUBVECTOR_DIMS = 32
+# Compressed candidates are re-scored against the full vectors on disk
+RERANK = utils.get_json_field('config.json', 'rerank') is not False
+RERANK_FACTOR = 4
+# Indexes can be built over a renormalized prefix of each embedding (e.g. 256 or
+# 768), set with the 'coarse_dims' field of config.json. The top COARSE_CANDIDATES
+# of that pass are then re-scored at full width.
+COARSE_DIMS = utils.get_json_field('config.json', 'coarse_dims') or EMBEDDING_SIZE
+COARSE_CANDIDATES = 256
+TRAIN_SIZE = 40 * IVF_NLIST
+EMBEDDING_WORKERS = utils.get_json_field('config.json', 'embedding_workers') or 8
+EMAILS_PER_APPEND = 200
+QUERY_CACHE_SIZE = 512
+# Chunks fetched per requested email before grouping, widened up to MAX_CHUNK_K
+OVERSAMPLE = 3
+MAX_CHUNK_K = 4096
+QUERY_CACHE_TTL = 60 * 60
+
+url = f"https://us-central1-aiplatform.googleapis.com/v1/projects/starry-diode-464720-n0/locations/us-central1/publishers/google/models/{EMBEDDING_MODEL}:predict"
+
 
-url = "https://us-central1-aiplatform.googleapis.com/v1/projects/starry-diode-464720-n0/locations/us-central1/publishers/google/models/gemini-embedding-001:predict"
+def _open_embedding_client() -> EmbeddingClient:
+    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    return EmbeddingClient(url, creds, max_workers=EMBEDDING_WORKERS)
 
-headers = {
-    "Authorization": f"Bearer {creds.token}",
-    "Content-Type": "application/json"
+
+SQ_TYPES = {
+    'fp16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit
 }
 
 
-index = faiss.IndexFlatIP(EMBEDDING_SIZE)
+def make_index(index_type: str, storage: str = 'flat', dims: int = EMBEDDING_SIZE) -> faiss.Index:
+    metric = faiss.METRIC_INNER_PRODUCT
+    pq_m = dims // PQ_SUBVECTOR_DIMS
+
+    if index_type == 'hnsw':
+        if storage == 'flat':
+            idx = faiss.IndexHNSWFlat(dims, HNSW_M, metric)
+        elif storage in SQ_TYPES:
+            idx = faiss.IndexHNSWSQ(dims, SQ_TYPES[storage], HNSW_M, metric)
+        elif storage == 'pq':
+            idx = faiss.IndexHNSWPQ(dims, pq_m, HNSW_M, 8, metric)
+        else:
+            raise ValueError(f'Unknown index storage: {storage}')
+        idx.hnsw.efConstruction = 200
+        return idx
+    
+    if index_type == 'ivf':
+        quantizer = faiss.IndexFlatIP(dims)
+        if storage == 'flat':
+            return faiss.IndexIVFFlat(quantizer, dims, IVF_NLIST, metric)
+        if storage in SQ_TYPES:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dims, IVF_NLIST, SQ_TYPES[storage], metric)
+        if storage == 'pq':
+            return faiss.IndexIVFPQ(quantizer, dims, IVF_NLIST, pq_m, 8, metric)
+        raise ValueError(f'Unknown index storage: {storage}')
+    
+    raise ValueError(f'Unknown index type: {index_type}')
+
+
+def truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    # Matryoshka embeddings stay meaningful when cut to a prefix and renormalized
+    if dims >= vectors.shape[1]:
+        return vectors
+    # Always a copy, a one-row slice is already contiguous and would be a view
+    prefix = np.array(vectors[:, :dims], dtype='float32', copy=True)
+    faiss.normalize_L2(prefix)
+    return prefix
+
+
+def train_and_fill(idx: faiss.Index, snapshot, start_row: int = 0):
+    # IVF, int8 and PQ need a training sample before anything can be added.
+    # Until there is enough data, rows stay out of the index and are searched exactly.
+    if not idx.is_trained:
+        if len(snapshot) < TRAIN_SIZE:
+            return
+        sample = np.random.default_rng(0).choice(len(snapshot), TRAIN_SIZE, replace=False)
+        idx.train(truncate(snapshot.take(np.sort(sample)), idx.d))
+        start_row = 0
+
+    for vectors in snapshot.iter_vectors(start_row):
+        idx.add(truncate(vectors, idx.d))
+
+
+def search_params(index_type: str, k: int, selector=None):
+    if index_type == 'ivf':
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+    return faiss.SearchParametersHNSW(sel=selector, efSearch=max(HNSW_EF_SEARCH, k))
+
+
+class Shard:
+    """One time partition of the vector store with its own FAISS index. The store
+    and index are only opened the first time the shard is touched."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.start, self.end = shard_bounds(key)
+        self.root = os.path.join(STORE_DIR, key)
+        self.index_path = os.path.join(self.root, 'index.faiss')
+        self.index_info_path = os.path.join(self.root, 'index.json')
+        # FAISS indexes can't be searched while another thread adds to them
+        self.lock = threading.Lock()
+        self._store = None
+        self._index = None
+        # email id -> its row numbers in the store
+        self._rows = None
+
+    @property
+    def store(self) -> VectorStore:
+        if self._store is None:
+            with self.lock:
+                if self._store is None:
+                    self._store = VectorStore(self.root, EMBEDDING_SIZE)
+                    self._index = self._load_index()
+        return self._store
+
+    def overlaps(self, start: date = None, end: date = None) -> bool:
+        return (not start or self.end >= start) and (not end or self.start <= end)
+
+    def _load_index(self) -> faiss.Index:
+        # Ids in the index are row numbers in the shard's store. Rows are only
+        # ever appended, so an index saved before a crash holds a prefix of them
+        # and just needs the rest added. It is rebuilt from the stored vectors
+        # when the configured kind changes.
+        if os.path.exists(self.index_path) and os.path.exists(self.index_info_path):
+            with open(self.index_info_path, 'r') as f:
+                info = json.load(f)
+            if info == self._index_info():
+                idx = faiss.read_index(self.index_path)
+                if idx.ntotal <= len(self._store):
+                    train_and_fill(idx, self._store.snapshot(), idx.ntotal)
+                    return idx
+
+        idx = make_index(INDEX_TYPE, INDEX_STORAGE, COARSE_DIMS)
+        train_and_fill(idx, self._store.snapshot())
+        return idx
+
+    def _index_info(self) -> dict:
+        return {"type": INDEX_TYPE, "storage": INDEX_STORAGE, "dims": COARSE_DIMS}
+
+    def _email_rows(self) -> dict[str, list[int]]:
+        if self._rows is None:
+            snapshot = self.store.snapshot()
+            rows = {}
+            for row, email_id in enumerate(snapshot.email_ids(np.arange(len(snapshot)))):
+                rows.setdefault(email_id, []).append(row)
+            self._rows = rows
+        return self._rows
+
+    def contains(self, email_id: str) -> bool:
+        return email_id in self._email_rows()
+
+    def chunk_vectors(self, email_id: str) -> np.ndarray:
+        rows = self._email_rows().get(email_id, [])
+        return self.store.snapshot().take(np.array(rows, dtype='int64'))
+
+    def append(self, vectors: np.ndarray, dates, email_ids, offsets):
+        start_row = self.store.append(vectors, dates, email_ids, offsets)
+        if self._rows is not None:
+            for i, email_id in enumerate(email_ids):
+                self._rows.setdefault(email_id, []).append(start_row + i)
+        with self.lock:
+            train_and_fill(self._index, self._store.snapshot(), start_row)
+
+    def search(self, query_embeddings: np.ndarray, k: int, start: date = None, end: date = None) -> list:
+        """Top k chunks within the window for each row of `query_embeddings`, as
+        (scores, email ids, chunk offsets)."""
+        snapshot = self.store.snapshot()
+        empty = (np.empty(0, dtype='float32'), np.empty(0, dtype=object), np.empty(0, dtype='int32'))
+
+        # Only shards at the edges of the window need a row filter
+        partial = (start and start > self.start) or (end and end < self.end)
+        row_ids = snapshot.rows_in_range(start, end) if partial else None
+
+        if len(snapshot) == 0 or (row_ids is not None and len(row_ids) == 0):
+            return [empty] * len(query_embeddings)
+
+        if self._index.ntotal < len(snapshot):
+            # Index not built yet (untrained IVF), small enough to scan exactly
+            if row_ids is None:
+                row_ids = np.arange(len(snapshot))
+            all_scores = snapshot.take(row_ids) @ query_embeddings.T
+            results = []
+            for scores in all_scores.T:
+                best = np.argsort(-scores)[:k]
+                rows = row_ids[best]
+                results.append((scores[best], snapshot.email_ids(rows), snapshot.chunk_offsets(rows)))
+            return results
+
+        coarse = COARSE_DIMS < EMBEDDING_SIZE
+        rerank = coarse or (RERANK and INDEX_STORAGE != 'flat')
+        fetch = k
+        if rerank:
+            fetch = max(k * RERANK_FACTOR, COARSE_CANDIDATES if coarse else 0)
+
+        selector = faiss.IDSelectorBatch(row_ids) if row_ids is not None else None
+        params = search_params(INDEX_TYPE, fetch, selector)
+
+        with self.lock:
+            D, I = self._index.search(truncate(query_embeddings, COARSE_DIMS), fetch, params=params)
+
+        results = []
+        for q, scores, rows in zip(query_embeddings, D, I):
+            # Rows appended after the snapshot was taken may already be in the index
+            keep = (rows != -1) & (rows < len(snapshot))
+            scores, rows = scores[keep], rows[keep]
+
+            if rerank:
+                # Coarse or compressed scores only pick candidates, exact ones come from disk
+                scores = snapshot.take(rows) @ q
+                best = np.argsort(-scores)[:k]
+                scores, rows = scores[best], rows[best]
+
+            results.append((scores, snapshot.email_ids(rows), snapshot.chunk_offsets(rows)))
+
+        return results
+
+    def flush(self):
+        # Seals buffered rows to disk, the index catches up from them on load
+        if self._store is not None:
+            self._store.save()
+
+    def save(self):
+        if self._store is None:
+            return
+        self._store.save()
+        with self.lock:
+            faiss.write_index(self._index, self.index_path)
+            with open(self.index_info_path, 'w') as f:
+                json.dump(self._index_info(), f)
+
+
+def shard_key(day: date) -> str:
+    if SHARD_PERIOD == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02d}'
+    return f'{day.year}-{day.month:02d}'
+
+
+def shard_bounds(key: str) -> tuple[date, date]:
+    if '-W' in key:
+        year, week = key.split('-W')
+        first = date.fromisocalendar(int(year), int(week), 1)
+        return first, first + timedelta(days=6)
+
+    year, month = map(int, key.split('-'))
+    first = date(year, month, 1)
+    return first, date(year, month, calendar.monthrange(year, month)[1])
+
+
+def get_shard(key: str) -> Shard:
+    loaded_shards()
+    return _get_or_add_shard(key)
+
+
+def _get_or_add_shard(key: str) -> Shard:
+    with shards_lock:
+        if key not in shards:
+            shards[key] = Shard(key)
+        return shards[key]
 
-data = utils.load_data()
 
-def parse_embeddings_json(response: requests.Response):
-    obj = response.json()
-    embeddings_list = []
+def loaded_shards() -> dict[str, Shard]:
+    """Every time shard, opened on first use."""
+    return services.get('shards')
 
-    for prediction in obj['predictions']:
-        embedding = prediction['embeddings']['values']
-        embeddings_list.append(embedding)
 
-    return embeddings_list
+def _open_shards() -> dict[str, Shard]:
+    shards.update(_load_shards())
+    _split_unsharded_store()
+    return shards
+
+
+def _load_shards() -> dict[str, Shard]:
+    os.makedirs(STORE_DIR, exist_ok=True)
+    return {
+        key: Shard(key) for key in sorted(os.listdir(STORE_DIR))
+        if os.path.exists(os.path.join(STORE_DIR, key, 'manifest.json'))
+    }
+
+
+def _split_unsharded_store():
+    # Data written before the store was partitioned, including the old
+    # per-dimension parquet frame, is re-routed into time shards once.
+    legacy = [os.path.join(STORE_DIR, 'manifest.json'), os.path.join(STORE_DIR, 'metadata.parquet'), LEGACY_PARQUET]
+    if not any(os.path.exists(path) for path in legacy):
+        return
+
+    old = VectorStore(STORE_DIR, EMBEDDING_SIZE, legacy_path=LEGACY_PARQUET)
+    for seg in old.snapshot().segments:
+        keys = np.array([shard_key(d) for d in seg.dates.astype(object)])
+        for key in np.unique(keys):
+            rows = np.flatnonzero(keys == key)
+            _get_or_add_shard(key).append(seg.vectors[rows], seg.dates[rows], seg.email_ids[rows], seg.chunk_offsets[rows])
+
+    for shard in shards.values():
+        shard.save()
+
+    old.destroy()
+    for path in (INDEX_PATH, LEGACY_PARQUET):
+        if os.path.exists(path):
+            os.replace(path, path + '.migrated')
+
+
+shards_lock = threading.Lock()
+# Filled on first use, saving and flushing only touch shards already open
+shards = {}
+services.register('shards', _open_shards)
+services.register('embedding_client', _open_embedding_client)
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL)
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    vectors = embedding_cache.get_many(texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+
+    if missing:
+        fetched = dict(zip(missing, services.get('embedding_client').embed(missing)))
+        embedding_cache.put_many(missing, [fetched[t] for t in missing])
+        vectors = [fetched[t] if v is None else v for t, v in zip(texts, vectors)]
+
+    return np.array(vectors, dtype='float32').reshape(-1, EMBEDDING_SIZE)
+
+
+def is_embedded(email: Email) -> bool:
+    return get_shard(shard_key(email.sentOn)).contains(email.email_id)
 
 
 def add_embeddings(emails: list[Email]):
-    global index, data
+    # Emails seen before, e.g. when a backfill window is listed again, are skipped
+    emails = [e for e in emails if not is_embedded(e)]
+    for i in range(0, len(emails), EMAILS_PER_APPEND):
+        embedding_map = split_texts(emails[i:i+EMAILS_PER_APPEND])
+        if not embedding_map[1]:
+            continue
 
-    for i in range(0, len(emails), 10):
-        embedding_map = split_texts(emails[i:i+10])
-        
+        store_embeddings(embedding_map[0], embed_texts(embedding_map[1]))
 
-        
 
-        response = requests.post(url, headers=headers, json= { "instances": [{"content": text} for text in embedding_map[1]] })
+def store_embeddings(chunk_info: list[tuple], vectors: np.ndarray):
+    """Routes embedded chunks, described by (date, email id, offset) tuples from
+    `split_texts`, into their time shards."""
+    dates, email_ids, offsets = map(np.array, zip(*chunk_info))
+    keys = np.array([shard_key(d) for d in dates])
 
-        data = pd.concat((
-            data, 
-            pd.DataFrame(
-                np.concat((embedding_map[0], parse_embeddings_json(response)), axis=1), 
-                columns=['Date', 'Email_IDs'] + [f'Embedding_{i}' for i in range(EMBEDDING_SIZE)]
-            )
-        ))
+    for key in np.unique(keys):
+        rows = np.flatnonzero(keys == key)
+        get_shard(key).append(vectors[rows], dates[rows], email_ids[rows], offsets[rows])
         
     
-def query_index(query: str, k: int, start: date = None, end: date = None) -> list[str]:
-    global index, data
+def email_vectors(emails: list[Email]) -> np.ndarray:
+    """One unit vector per email, the mean of its chunk embeddings. Chunks are
+    read from the email's shard, only emails never stored are embedded."""
+    vectors = np.zeros((len(emails), EMBEDDING_SIZE), dtype='float32')
+    missing = []
+    for i, email in enumerate(emails):
+        chunks = get_shard(shard_key(email.sentOn)).chunk_vectors(email.email_id)
+        if len(chunks):
+            vectors[i] = chunks.sum(axis=0)
+        else:
+            missing.append(i)
 
+    chunk_info, texts = split_texts([emails[i] for i in missing])
+    if texts:
+        rows = {emails[i].email_id: i for i in missing}
+        np.add.at(vectors, [rows[email_id] for _, email_id, _ in chunk_info], embed_texts(texts))
 
-    if not start:
-        start = data.index[0].date()
-    
-    if not end:
-        end = data.index[len(data)-1].date()
+    faiss.normalize_L2(vectors)
+    return vectors
 
-    relevant_data = data[start:end]
 
-    email_ids = relevant_data['Email_IDs'].to_numpy()
-    embeddings = relevant_data[[f'Embedding_{i}' for i in range(EMBEDDING_SIZE)]].to_numpy()
+def embed_queries(queries: list[str]) -> np.ndarray:
+    # Repeated queries within a conversation skip the embedding round trip
+    cached = [query_cache.get(q) for q in queries]
+    missing = list(dict.fromkeys(q for q, v in zip(queries, cached) if v is None))
 
+    if missing:
+        fetched = dict(zip(missing, embed_texts(missing)))
+        for q in missing:
+            query_cache.put(q, fetched[q])
+        cached = [fetched[q] if v is None else v for q, v in zip(queries, cached)]
 
-    response = requests.post(url, headers=headers, json= { "instances": [{"content": query}] })
-    query_embedding = parse_embeddings_json(response)[0]
-    
-    index.add(np.ascontiguousarray(embeddings))
-    D, I = index.search(np.ascontiguousarray(
-        np.array(query_embedding, dtype='float32').reshape(1, EMBEDDING_SIZE)
-    ), k)
+    return np.array(cached, dtype='float32').reshape(-1, EMBEDDING_SIZE)
+
+
+def query_index(query: str, k: int, start: date = None, end: date = None, pooling: str = 'max') -> list[dict]:
+    return query_index_batch([query], k, start, end, pooling)[0]
+
+
+def query_index_batch(queries: list[str], k: int, start: date = None, end: date = None, pooling: str = 'max') -> list[list[dict]]:
+    """The k best distinct emails for each query, scored by max or sum pooling over
+    their matching chunks, with the offset of each email's best chunk."""
+
+    loaded = loaded_shards()
+    with shards_lock:
+        relevant = [shard for shard in loaded.values() if shard.overlaps(start, end)]
+
+    if not relevant or not queries:
+        return [[] for _ in queries]
 
-    index.reset()
-    return [email_ids[i] for i in I[0] if i != -1]
+    # All queries are embedded in one request and searched in one call per shard
+    query_embeddings = embed_queries(queries)
 
-def split_texts(emails: list[Email]):
+    results = [None] * len(queries)
+    pending = list(range(len(queries)))
+    chunk_k = k * OVERSAMPLE
 
-    embedding_map = ([], [])
-    for email in emails:
-        email_txt = email.model_dump_json(exclude={'sentOn', 'email_id'})
-        for i in range(0, len(email.text), 900):
-            embedding_map[0].append([email.sentOn, email.email_id])
-            embedding_map[1].append(email_txt[i: i + 1000])
+    # Long emails can own several of the top chunks, so keep widening the chunk
+    # search until every query has k distinct emails or the window runs out.
+    while pending:
+        chunks = _search_chunks(relevant, query_embeddings[pending], chunk_k, start, end)
 
-    return embedding_map
+        still_pending = []
+        for i, (scores, email_ids, offsets) in zip(pending, chunks):
+            results[i] = _group_by_email(scores, email_ids, offsets, k, pooling)
+            if len(results[i]) < k and len(scores) == chunk_k and chunk_k < MAX_CHUNK_K:
+                still_pending.append(i)
+
+        pending = still_pending
+        chunk_k *= 2
+
+    return results
+
+
+def _search_chunks(relevant: list[Shard], query_embeddings: np.ndarray, k: int, start: date, end: date) -> list:
+    shard_results = [shard.search(query_embeddings, k, start, end) for shard in relevant]
+
+    # Each shard returns its own top k, the overall top k is among them
+    merged = []
+    for i in range(len(query_embeddings)):
+        scores, email_ids, offsets = (np.concatenate(col) for col in zip(*[result[i] for result in shard_results]))
+        best = np.argsort(-scores, kind='stable')[:k]
+        merged.append((scores[best], email_ids[best], offsets[best]))
+
+    return merged
+
+
+def _group_by_email(scores: np.ndarray, email_ids: np.ndarray, offsets: np.ndarray, k: int, pooling: str) -> list[dict]:
+    emails = {}
+    # Chunks arrive best first, so the first chunk seen is each email's best
+    for score, email_id, offset in zip(scores, email_ids, offsets):
+        if email_id not in emails:
+            emails[email_id] = {"email_id": email_id, "chunk_offset": int(offset), "score": float(score)}
+        elif pooling == 'sum':
+            emails[email_id]["score"] += float(score)
+
+    return sorted(emails.values(), key=lambda e: -e["score"])[:k]
 
 
 def save_index():
-    utils.save_data(data)
+    with shards_lock:
+        loaded = list(shards.values())
+
+    for shard in loaded:
+        shard.save()
+
+
+def flush_vectors():
+    with shards_lock:
+        loaded = list(shards.values())
+
+    for shard in loaded:
+        shard.flush()
+
+
+
+def recall_report(k: int = 10, n_queries: int = 100, key: str = None) -> list[dict]:
+    """Compares every index storage mode and coarse width against exact search on
+    one shard, using stored chunks as queries so no embedding calls are made."""
+
+    loaded = loaded_shards()
+    key = key or max(loaded, key=lambda key: len(loaded[key].store))
+    snapshot = loaded[key].store.snapshot()
+
+    rng = np.random.default_rng(0)
+    queries = snapshot.take(np.sort(rng.choice(len(snapshot), min(n_queries, len(snapshot)), replace=False)))
+    vectors = snapshot.take(np.arange(len(snapshot)))
+
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+    report = []
+    for dims in (256, 768, EMBEDDING_SIZE):
+        fetch = max(k * RERANK_FACTOR, COARSE_CANDIDATES if dims < EMBEDDING_SIZE else 0)
+        coarse_vectors = truncate(vectors, dims)
+
+        for storage in ('flat', 'fp16', 'int8', 'pq'):
+            idx = make_index(INDEX_TYPE, storage, dims)
+            if not idx.is_trained:
+                idx.train(coarse_vectors[np.sort(rng.choice(len(vectors), min(TRAIN_SIZE, len(vectors)), replace=False))])
+            idx.add(coarse_vectors)
+
+            _, candidates = idx.search(truncate(queries, dims), fetch, params=search_params(INDEX_TYPE, fetch))
+
+            approx = candidates[:, :k]
+            reranked = []
+            for q, rows in zip(queries, candidates):
+                rows = rows[rows != -1]
+                reranked.append(rows[np.argsort(-(vectors[rows] @ q))[:k]])
+
+            report.append({
+                "dims": dims,
+                "storage": storage,
+                "bytes_per_vector": faiss.serialize_index(idx).nbytes / idx.ntotal,
+                "recall": np.mean([len(set(a) & set(e)) / k for a, e in zip(approx, exact)]),
+                "recall_reranked": np.mean([len(set(r) & set(e)) / k for r, e in zip(reranked, exact)])
+            })
 
+    return report
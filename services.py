@@ -0,0 +1,60 @@
+import threading
+import time
+
+from googleapiclient.discovery import build, build_from_document, Resource
+from googleapiclient.discovery_cache import get_static_doc
+
+
+# Services are built the first time they are asked for, not at import, so a
+# script only pays for the clients, credentials and indexes it actually uses
+_factories = {}
+_instances = {}
+_timings = {}
+# Reentrant, factories ask for the services they depend on
+_lock = threading.RLock()
+_started = time.perf_counter()
+
+_discovery_docs = {}
+_docs_lock = threading.Lock()
+
+
+def register(name: str, factory):
+    _factories[name] = factory
+
+
+def get(name: str):
+    if name in _instances:
+        return _instances[name]
+
+    with _lock:
+        if name not in _instances:
+            start = time.perf_counter()
+            _instances[name] = _factories[name]()
+            _timings[name] = time.perf_counter() - start
+    return _instances[name]
+
+
+def discovery_client(api: str, version: str, credentials) -> Resource:
+    """Builds a Google API client from the bundled discovery document, read
+    once per process."""
+    with _docs_lock:
+        if (api, version) not in _discovery_docs:
+            _discovery_docs[api, version] = get_static_doc(api, version)
+        doc = _discovery_docs[api, version]
+
+    # The parsed document is changed in place while a client is built, so
+    # every client parses its own copy of the text
+    if doc is None:
+        return build(api, version, credentials=credentials)
+    return build_from_document(doc, credentials=credentials)
+
+
+def report():
+    """Prints how long each service took to build, including any services it
+    built first, and which were never needed."""
+    print(f'Started in {time.perf_counter() - _started:.2f}s')
+    for name, seconds in _timings.items():
+        print(f'  {name}: {seconds:.2f}s')
+
+    if unused := [name for name in _factories if name not in _instances]:
+        print(f'  not loaded: {", ".join(unused)}')
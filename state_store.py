@@ -0,0 +1,49 @@
+import atexit
+import json
+import threading
+
+from local_db import connect
+
+
+class StateStore:
+    """Key-value store for runtime state like the history cursor. Writes are
+    batched and committed at most `flush_every` seconds later."""
+
+    def __init__(self, path: str, flush_every: float = 1.):
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+        self._conn = connect(path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+        atexit.register(self.flush)
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            row = self._conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._pending[key] = value
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_every, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if pending:
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO state VALUES (?, ?)',
+                        [(key, json.dumps(value)) for key, value in pending.items()]
+                    )
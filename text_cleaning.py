@@ -0,0 +1,97 @@
+import re
+import time
+import unicodedata
+
+from urllib.parse import urlparse
+
+
+INVISIBLE_CHARS = [
+    '\u034f',  # combining grapheme joiner
+    '\u200b',  # zero-width space
+    '\u200c',  # zero-width non-joiner
+    '\u200d',  # zero-width joiner
+    '\u2060',  # word joiner
+    '\ufeff',  # BOM
+    '\u00a0',  # non-breaking space
+    '\u2019',
+    '\u2013'
+]
+
+NEWLINE_TAG = r'</?(?i:p|div|br|li|ul|ol|tr|h[1-6])[^>]*>'
+
+
+class EmailTextNormalizer:
+    """Cleans email bodies, matching `reference_normalize` exactly."""
+
+    def __init__(self):
+        self.invisible = re.compile('[' + ''.join(INVISIBLE_CHARS) + ']')
+        # The netloc is captured directly, urlparse is only needed for the rare
+        # hosts it would reject or rewrite
+        self.urls = re.compile(r'https?://(?=\S)([^\s/?#]*)\S*')
+        self.newline_tags = re.compile(NEWLINE_TAG)
+        self.tags = re.compile(r'<[^>]+>')
+        self.spaces = re.compile(r'\t[ \t]*| [ \t]+')
+        # A line break with any blank lines and indentation after it
+        self.line_breaks = re.compile(r'\n(?:[ \t]*\n)*[ \t]*')
+
+    def __call__(self, text: str) -> str:
+        # Every step is a single scan with a constant replacement, so apart from
+        # URLs no Python code runs per match
+        text = self.invisible.sub('', unicodedata.normalize('NFKC', text))
+        text = self.urls.sub(_url_domain, text)
+        text = self.tags.sub('', self.newline_tags.sub('\n', text)).replace('&zwnj;', '')
+        text = self.spaces.sub(' ', text).replace('\r\n', '\n')
+        return self.line_breaks.sub('\n', text).strip()
+
+
+def _url_domain(match: re.Match) -> str:
+    netloc = match.group(1)
+    if netloc.isascii() and '[' not in netloc and ']' not in netloc:
+        return netloc.removeprefix('www.')
+    return _reference_url_domain(match)
+
+
+def reference_normalize(text: str) -> str:
+    """The original pass-per-step cleaning, kept as the definition that
+    `EmailTextNormalizer` is checked against."""
+    text = unicodedata.normalize('NFKC', text)
+    text = re.sub('[' + ''.join(INVISIBLE_CHARS) + ']', '', text)
+    text = re.sub(r'https?://[^\s]+', _reference_url_domain, text)
+
+    text = re.sub(NEWLINE_TAG, '\n', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'(&zwnj;)+', '', text)
+
+    text = re.sub(r'\n +', '\n', re.sub(r'(?:\r\n)+', '\n', re.sub(r'( |\t)+', ' ', text))).strip()
+    return re.sub(r'\n+', '\n', text)
+
+
+def _reference_url_domain(match: re.Match) -> str:
+    try:
+        domain = urlparse(match.group()).netloc
+    except Exception:
+        return ''
+    return domain.removeprefix('www.')
+
+
+normalize_email_text = EmailTextNormalizer()
+
+
+def benchmark(bodies: list[str], repeat: int = 3) -> dict:
+    """Times both cleaners over `bodies`, reporting throughput in MB/s of input
+    and how many bodies the fast one cleaned differently."""
+
+    size = sum(len(body.encode('utf-8')) for body in bodies) / 1e6
+    report = {"bodies": len(bodies), "mb": size}
+
+    for name, clean in (('reference', reference_normalize), ('normalizer', normalize_email_text)):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for body in bodies:
+                clean(body)
+            best = min(best, time.perf_counter() - start)
+        report[f'{name}_mb_per_sec'] = size / best if best else 0.
+
+    report["mismatches"] = sum(reference_normalize(b) != normalize_email_text(b) for b in bodies)
+    return report
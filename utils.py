@@ -1,5 +1,8 @@
 import json
 import os
+import threading
+
+import services
 
 from typing import Union
 from pathlib import Path
@@ -9,8 +12,6 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build, Resource
 from googleapiclient.errors import HttpError
-import pandas as pd
-import numpy as np
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify",
         "https://www.googleapis.com/auth/calendar",
@@ -18,48 +19,39 @@ SCOPES = ["https://www.googleapis.com/auth/gmail.modify",
 
 JSON_DIR = 'json_dir' # Insert your Json root directory name here
 
-def update_json(filename: str, key: str, val):
+# Static config is read once per file and kept in memory. Runtime state
+# belongs in the StateStore, not here.
+_json_cache = {}
+_json_lock = threading.Lock()
 
-    file = os.path.join(JSON_DIR, filename)
 
-    with open(file, 'r') as f:
-        data = json.load(f)
-
-    data[key] = val
-    
-    with open(file, 'w') as f:
-        json.dump(data, f, indent=4)
+def _load_json(filename: str) -> dict:
+    with _json_lock:
+        if filename not in _json_cache:
+            with open(os.path.join(JSON_DIR, filename), 'r') as f:
+                _json_cache[filename] = json.load(f)
+        return _json_cache[filename]
 
 
-def get_json_field(filename: str, key: str):
-
+def update_json(filename: str, key: str, val):
+    # For setup-time changes like created label ids, written through a
+    # temporary file so a crash never leaves half a config behind
     file = os.path.join(JSON_DIR, filename)
 
-    with open(file, 'r') as f:
-        data = json.load(f)
-
-    return data.get(key, None)
+    with _json_lock:
+        with open(file, 'r') as f:
+            data = json.load(f)
 
-def save_data(idx: pd.DataFrame):
-    idx.to_csv('./data/index.csv')
-    idx.to_parquet('./data/index.parquet', engine='fastparquet')
+        data[key] = val
 
+        with open(file + '.tmp', 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(file + '.tmp', file)
+        _json_cache[filename] = data
 
-def load_data() -> pd.DataFrame:
-    if os.path.exists(f'./data/index.parquet'):
-        df = pd.read_parquet(f'./data/index.parquet', engine='fastparquet')
-
-
-        return df
-    
-
-    df = pd.DataFrame(columns=['Date', 'Email_IDs'] + [f'Embedding_{i}' for i in range(3072)])
-    df['Date'] = pd.to_datetime(df['Date'],  errors='coerce')
-    df = df.set_index('Date')
-
-
-    return df
 
+def get_json_field(filename: str, key: str):
+    return _load_json(filename).get(key, None)
 
 def get_creds():
     creds = None
@@ -91,4 +83,11 @@ def get_creds():
 
     return creds
 
-creds = get_creds()
\ No newline at end of file
+services.register('creds', get_creds)
+
+
+def __getattr__(name: str):
+    # utils.creds runs the OAuth flow the first time it is read, not at import
+    if name == 'creds':
+        return services.get('creds')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
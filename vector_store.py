@@ -0,0 +1,362 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+from datetime import date
+
+
+LEGACY_PARQUET = './data/index.parquet'
+
+SEGMENT_ROWS = 2048        # rows buffered in memory before a segment is sealed
+COMPACT_FANOUT = 8         # segments of one size tier merged at a time
+MAX_SEGMENT_ROWS = 1 << 17 # compaction never builds segments bigger than this
+
+# One background thread compacts every store, so idle stores cost nothing
+_compaction_queue = queue.Queue()
+_compactor = None
+_compactor_lock = threading.Lock()
+
+
+def _schedule_compaction(store):
+    global _compactor
+
+    with _compactor_lock:
+        if _compactor is None:
+            _compactor = threading.Thread(target=_compaction_loop, daemon=True)
+            _compactor.start()
+
+    _compaction_queue.put(store)
+
+
+def _compaction_loop():
+    while True:
+        _compaction_queue.get().compact()
+
+
+class Segment:
+    """An immutable run of rows: a float32 vector matrix and its metadata columns."""
+
+    def __init__(self, name: str, vectors: np.ndarray, dates: np.ndarray, email_ids: np.ndarray, chunk_offsets: np.ndarray):
+        self.name = name
+        self.vectors = vectors
+        self.dates = dates
+        self.email_ids = email_ids
+        self.chunk_offsets = chunk_offsets
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def load(cls, root: str, name: str):
+        meta = pd.read_parquet(os.path.join(root, name + '.parquet'), engine='fastparquet')
+        return cls(
+            name,
+            np.load(os.path.join(root, name + '.npy'), mmap_mode='r'),
+            meta['date'].to_numpy().astype('datetime64[D]'),
+            meta['email_id'].to_numpy(dtype=object),
+            meta['chunk_offset'].to_numpy(dtype='int32')
+        )
+
+    @classmethod
+    def write(cls, root: str, name: str, vectors: np.ndarray, dates: np.ndarray, email_ids: np.ndarray, chunk_offsets: np.ndarray):
+        vectors_path = os.path.join(root, name + '.npy')
+        meta_path = os.path.join(root, name + '.parquet')
+
+        if not isinstance(vectors, np.memmap):
+            np.save(vectors_path + '.tmp.npy', vectors)
+            os.replace(vectors_path + '.tmp.npy', vectors_path)
+
+        pd.DataFrame({
+            'date': dates.astype('datetime64[ns]'),
+            'email_id': email_ids,
+            'chunk_offset': chunk_offsets
+        }).to_parquet(meta_path + '.tmp', engine='fastparquet')
+        os.replace(meta_path + '.tmp', meta_path)
+
+        return cls.load(root, name)
+
+    def delete(self, root: str):
+        # Open snapshots keep their memory maps valid after the unlink
+        for ext in ('.npy', '.parquet'):
+            path = os.path.join(root, self.name + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Snapshot:
+    """A consistent, read-only view of the store. Row numbers are global and
+    stay stable across compactions since only neighbouring segments are merged."""
+
+    def __init__(self, segments: tuple[Segment, ...]):
+        self.segments = segments
+        self.bases = np.cumsum([0] + [len(seg) for seg in segments])
+
+    def __len__(self):
+        return int(self.bases[-1])
+
+    def rows_in_range(self, start: date = None, end: date = None) -> np.ndarray:
+        rows = []
+        for base, seg in zip(self.bases, self.segments):
+            mask = np.ones(len(seg), dtype=bool)
+            if start:
+                mask &= seg.dates >= np.datetime64(start, 'D')
+            if end:
+                mask &= seg.dates <= np.datetime64(end, 'D')
+            rows.append(np.flatnonzero(mask) + base)
+
+        if not rows:
+            return np.empty(0, dtype='int64')
+        return np.concatenate(rows).astype('int64')
+
+    def _locate(self, rows: np.ndarray):
+        rows = np.asarray(rows, dtype='int64')
+        seg_idx = np.searchsorted(self.bases, rows, side='right') - 1
+        return seg_idx, rows - self.bases[seg_idx]
+
+    def take(self, rows) -> np.ndarray:
+        seg_idx, local = self._locate(rows)
+        out = np.empty((len(local), self.segments[0].vectors.shape[1] if self.segments else 0), dtype='float32')
+        for s in np.unique(seg_idx):
+            mask = seg_idx == s
+            out[mask] = self.segments[s].vectors[local[mask]]
+        return out
+
+    def email_ids(self, rows) -> np.ndarray:
+        seg_idx, local = self._locate(rows)
+        return np.array([self.segments[s].email_ids[i] for s, i in zip(seg_idx, local)], dtype=object)
+
+    def chunk_offsets(self, rows) -> np.ndarray:
+        seg_idx, local = self._locate(rows)
+        return np.array([self.segments[s].chunk_offsets[i] for s, i in zip(seg_idx, local)], dtype='int32')
+
+    def iter_vectors(self, start_row: int = 0):
+        for base, seg in zip(self.bases, self.segments):
+            if base + len(seg) <= start_row:
+                continue
+            yield seg.vectors[max(0, start_row - base):len(seg)]
+
+
+class VectorStore:
+    """Append-only segment log of embeddings, read through `snapshot()`."""
+
+    def __init__(self, root: str, dim: int, segment_rows: int = SEGMENT_ROWS, legacy_path: str = None):
+        self.root = root
+        self.dim = dim
+        self.segment_rows = segment_rows
+        self.manifest_path = os.path.join(root, 'manifest.json')
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._sealed = []
+        self._next_id = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._new_buffer()
+
+        if os.path.exists(self.manifest_path):
+            self._load()
+        else:
+            self._publish()
+            if os.path.exists(os.path.join(root, 'metadata.parquet')):
+                self._import_single_matrix()
+            elif legacy_path and os.path.exists(legacy_path):
+                self._import_legacy(legacy_path)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def append(self, vectors, dates: list[date], email_ids: list[str], chunk_offsets: list[int]) -> int:
+        vectors = np.asarray(vectors, dtype='float32').reshape(-1, self.dim)
+        dates = np.array(dates, dtype='datetime64[D]')
+        email_ids = np.array(email_ids, dtype=object)
+        chunk_offsets = np.array(chunk_offsets, dtype='int32')
+
+        start = len(self)
+        i = 0
+        while i < len(vectors):
+            n = min(len(vectors) - i, self.segment_rows - self._buf_len)
+            j = self._buf_len
+            # Rows below _buf_len are never written again, so published
+            # snapshots holding views of the buffer stay consistent.
+            self._buf_vectors[j:j + n] = vectors[i:i + n]
+            self._buf_dates[j:j + n] = dates[i:i + n]
+            self._buf_ids[j:j + n] = email_ids[i:i + n]
+            self._buf_offsets[j:j + n] = chunk_offsets[i:i + n]
+            self._buf_len += n
+            i += n
+
+            if self._buf_len == self.segment_rows:
+                self._seal()
+
+        with self._lock:
+            self._publish()
+
+        return start
+
+    def save(self):
+        self._seal()
+
+    def destroy(self):
+        with self._compact_lock, self._lock:
+            for seg in self._sealed:
+                seg.delete(self.root)
+            self._sealed = []
+            self._new_buffer()
+            self._publish()
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+
+    def compact(self):
+        with self._compact_lock:
+            while True:
+                with self._lock:
+                    run = self._pick_run()
+                    if run is None:
+                        return
+                    name = self._segment_name()
+
+                merged = self._merge(name, run)
+
+                with self._lock:
+                    i = next(i for i, seg in enumerate(self._sealed) if seg is run[0])
+                    self._sealed[i:i + len(run)] = [merged]
+                    self._write_manifest()
+                    self._publish()
+
+                for seg in run:
+                    seg.delete(self.root)
+
+    def _new_buffer(self):
+        self._buf_vectors = np.empty((self.segment_rows, self.dim), dtype='float32')
+        self._buf_dates = np.empty(self.segment_rows, dtype='datetime64[D]')
+        self._buf_ids = np.empty(self.segment_rows, dtype=object)
+        self._buf_offsets = np.empty(self.segment_rows, dtype='int32')
+        self._buf_len = 0
+
+    def _active_segment(self):
+        n = self._buf_len
+        return Segment('active', self._buf_vectors[:n], self._buf_dates[:n], self._buf_ids[:n], self._buf_offsets[:n])
+
+    def _publish(self):
+        segments = tuple(self._sealed)
+        if self._buf_len:
+            segments += (self._active_segment(),)
+        self._snapshot = Snapshot(segments)
+
+    def _segment_name(self):
+        name = f'seg_{self._next_id:06d}'
+        self._next_id += 1
+        return name
+
+    def _seal(self):
+        if not self._buf_len:
+            return
+
+        n = self._buf_len
+        with self._lock:
+            name = self._segment_name()
+
+        seg = Segment.write(self.root, name, self._buf_vectors[:n], self._buf_dates[:n], self._buf_ids[:n], self._buf_offsets[:n])
+
+        with self._lock:
+            self._sealed.append(seg)
+            self._new_buffer()
+            self._write_manifest()
+            self._publish()
+
+        _schedule_compaction(self)
+
+    def _write_manifest(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({
+                'dim': self.dim,
+                'next_id': self._next_id,
+                'segments': [seg.name for seg in self._sealed]
+            }, f)
+        os.replace(tmp, self.manifest_path)
+
+    def _load(self):
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+        self._next_id = manifest['next_id']
+        self._sealed = [Segment.load(self.root, name) for name in manifest['segments']]
+
+        # Anything not in the manifest is left over from an interrupted seal or merge
+        live = set(manifest['segments'])
+        for file in os.listdir(self.root):
+            stem = file.split('.')[0]
+            if stem.startswith('seg_') and stem not in live:
+                os.remove(os.path.join(self.root, file))
+
+        self._publish()
+
+    def _tier(self, seg: Segment) -> int:
+        tier, size = 0, self.segment_rows
+        while len(seg) > size:
+            size *= COMPACT_FANOUT
+            tier += 1
+        return tier
+
+    def _pick_run(self):
+        # Only neighbours are merged so global row numbers never change
+        segments = self._sealed
+        for i in range(len(segments) - COMPACT_FANOUT + 1):
+            run = segments[i:i + COMPACT_FANOUT]
+            tier = self._tier(run[0])
+            if all(self._tier(seg) == tier for seg in run) and sum(len(seg) for seg in run) <= MAX_SEGMENT_ROWS:
+                return run
+        return None
+
+    def _merge(self, name: str, run: list[Segment]) -> Segment:
+        # Streams through a memory map so compaction memory is bounded by metadata size
+        vectors_path = os.path.join(self.root, name + '.npy')
+        total = sum(len(seg) for seg in run)
+        merged = np.lib.format.open_memmap(vectors_path + '.tmp.npy', mode='w+', dtype='float32', shape=(total, self.dim))
+
+        row = 0
+        for seg in run:
+            merged[row:row + len(seg)] = seg.vectors
+            row += len(seg)
+        merged.flush()
+        del merged
+        os.replace(vectors_path + '.tmp.npy', vectors_path)
+
+        return Segment.write(
+            self.root, name,
+            np.load(vectors_path, mmap_mode='r'),
+            np.concatenate([seg.dates for seg in run]),
+            np.concatenate([seg.email_ids for seg in run]),
+            np.concatenate([seg.chunk_offsets for seg in run])
+        )
+
+    def _import(self, vectors: np.ndarray, dates, email_ids, chunk_offsets):
+        for i in range(0, len(vectors), self.segment_rows):
+            j = i + self.segment_rows
+            self.append(vectors[i:j], dates[i:j], email_ids[i:j], chunk_offsets[i:j])
+        self.save()
+
+    def _import_single_matrix(self):
+        # Layout written before the segment log: one vectors.npy plus metadata.parquet
+        meta = pd.read_parquet(os.path.join(self.root, 'metadata.parquet'), engine='fastparquet')
+        vectors = np.load(os.path.join(self.root, 'vectors.npy'), mmap_mode='r')[:len(meta)]
+        self._import(vectors, meta['date'].to_numpy().astype('datetime64[D]'), meta['email_id'].to_numpy(dtype=object), meta['chunk_offset'].to_numpy(dtype='int32'))
+
+        os.remove(os.path.join(self.root, 'metadata.parquet'))
+        os.remove(os.path.join(self.root, 'vectors.npy'))
+
+    def _import_legacy(self, path: str):
+        # Old frame with one column per embedding dimension
+        df = pd.read_parquet(path, engine='fastparquet')
+        if len(df) == 0:
+            return
+
+        vectors = df[[f'Embedding_{i}' for i in range(self.dim)]].to_numpy(dtype='float32')
+        self._import(vectors, pd.to_datetime(df.index).to_numpy().astype('datetime64[D]'), df['Email_IDs'].to_numpy(dtype=object), np.zeros(len(df), dtype='int32'))
@@ -4,10 +4,18 @@ import semantics
 import classification
 import gmail_tools
 import utils
+import services
 import chatbot
 from pynput import mouse
 from datetime import date
 from data_schemas import Email
+from label_model import KnnLabelModel
+from label_rules import LabelRules, VerdictCache
+from local_db import STATE_DB_PATH
+
+LABEL_MODEL_PATH = './data/label_model.npz'
+# Labelled emails per label the model starts from on a first run
+BOOTSTRAP_PER_LABEL = 500
 
 notifier = threading.Condition()
 agent_relevant_categories = set(['needs_action', 'to_schedule'])
@@ -15,15 +23,74 @@ agent_relevant_categories = set(['needs_action', 'to_schedule'])
 agent_relevant_emails = []
 end = False
 
+label_model = KnnLabelModel(
+    LABEL_MODEL_PATH, classification.label_map, threshold=utils.get_json_field('config.json', 'knn_threshold') or .8
+)
+gmail_tools.label_listeners.append(label_model.relabel)
+label_rules = LabelRules(utils.get_json_field('config.json', 'label_rules') or [], classification.label_map)
+verdict_cache = VerdictCache(STATE_DB_PATH)
+
+
+
+def train_label_model():
+    # Emails labelled before the model existed are its first examples
+    for label in classification.label_map:
+        if emails := gmail_tools.mail_store.search(labels=[label], limit=BOOTSTRAP_PER_LABEL):
+            label_model.learn([e.email_id for e in emails], semantics.email_vectors(emails), [label] * len(emails))
+    label_model.save()
+
+
+def label_emails(emails: list[Email]) -> list[str]:
+    # Cheapest first: header and sender rules, verdicts for emails and lists
+    # seen before, the label model, and the LLM for whatever is left
+    labels = [label_rules.match(email) for email in emails]
+
+    todo = [i for i, label in enumerate(labels) if label is None]
+    for i, label in zip(todo, verdict_cache.get_many([emails[i] for i in todo])):
+        labels[i] = label
+
+    todo = [i for i in todo if labels[i] is None]
+    vectors = semantics.email_vectors([emails[i] for i in todo])
+    for i, label in zip(todo, label_model.predict(vectors)):
+        labels[i] = label
+
+    # The LLM's answers become new examples for the label model
+    unsure = [j for j, i in enumerate(todo) if labels[i] is None]
+    for j, label in zip(unsure, classification.classify([emails[todo[j]] for j in unsure])):
+        labels[todo[j]] = label
+    learned = [j for j in unsure if labels[todo[j]] is not None]
+    label_model.learn([emails[todo[j]].email_id for j in learned], vectors[learned], [labels[todo[j]] for j in learned])
+
+    verdicts = [i for i in todo if labels[i] is not None]
+    verdict_cache.put_many([emails[i] for i in verdicts], [labels[i] for i in verdicts])
+    return labels
+
+
+def relabel_verdict(email_id: str, added: list[str] = (), removed: list[str] = ()):
+    # A label the user picks in Gmail replaces the cached verdict. Our own
+    # label writes come back through history too and are already cached.
+    added = [label for label in added if label in classification.label_map]
+    if added and (email := gmail_tools.mail_store.get_email(email_id)):
+        if verdict_cache.get_many([email]) != added[-1:]:
+            verdict_cache.put_many([email], added[-1:])
+
+
+gmail_tools.label_listeners.append(relabel_verdict)
 
 
 def process_emails(emails: list[Email]):
+    # Everything since the last history sync has now been read from Gmail
+    gmail_tools.mail_store.add_emails(emails)
+    gmail_tools.mail_store.sync_checkpoint(date.today())
     semantics.add_embeddings(emails)
-    classifications = classification.classify(emails)
+    classifications = label_emails(emails)
     for i in range(len(emails)):
-        gmail_tools.add_email_label(emails[i].email_id, classifications[i])
+        if classifications[i] is None:
+            continue
+        gmail_tools.label_queue.add(emails[i], classifications[i])
         if classifications[i] in agent_relevant_categories:
             agent_relevant_emails.append(emails[i])
+    gmail_tools.label_queue.flush()
 
 
 
@@ -43,10 +110,13 @@ def mouse_listener():
         listener.join()
 
 
+if not len(label_model):
+    train_label_model()
 process_emails(gmail_tools.get_backlogged_emails())
 
 gmail_tools.start_email_checking(utils.creds, process_emails)
 threading.Thread(target=mouse_listener, daemon=True).start()
+services.report()
 
 
 while True: